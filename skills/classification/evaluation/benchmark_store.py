@@ -0,0 +1,31 @@
+"""How ../../vectordb_benchmark.py opens, fills, reloads and searches this skill's VectorDB."""
+
+import os
+
+from vectordb import VectorDB
+
+NAME = "classification"
+
+
+# The store lives at ../data/vector_db-<model> relative to the working directory.
+def open_store(root, embedder):
+    return VectorDB(embedder=embedder, query_cache_path=os.path.join(root, "query_cache.sqlite"))
+
+
+def build_store(db, embeddings, metadata):
+    db.embeddings, db.metadata = embeddings, metadata
+    db._build_metadata_index()
+
+
+def load_store(root, embedder):
+    db = open_store(root, embedder)
+    db.load_db()
+    return db
+
+
+def search(db, query, k):
+    return db.search(query, k=k, similarity_threshold=-1.0)
+
+
+def search_many(db, queries, k):
+    return db.search_many(queries, k=k, similarity_threshold=-1.0)
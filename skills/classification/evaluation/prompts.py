@@ -1,8 +1,24 @@
 from vectordb import VectorDB
+import csv
+import functools
+import os
 import textwrap
-vectordb = VectorDB()
-# Load the vector database
-vectordb.load_db()
+
+
+def _load_vectordb():
+    db = VectorDB()
+    if os.path.exists(os.path.join(db.db_path, "manifest.json")) or os.path.exists(db.legacy_db_path):
+        db.load_db()
+    else:
+        # No store for this embedder yet (e.g. EMBEDDING_PROVIDER=hashing): embed the
+        # training set once, as guide.ipynb does, and save it for later runs
+        with open("../data/train.tsv", newline="") as file:
+            db.load_data([{"text": row["text"], "label": row["label"]} for row in csv.DictReader(file, delimiter="\t")])
+        db.save_db()
+    return db
+
+
+vectordb = _load_vectordb()
 
 categories = """<category> 
     <label>Billing Inquiries</label>
@@ -56,6 +72,30 @@ categories = """<category>
 </category>"""
 
 
+def _render_example(text, label):
+    return textwrap.dedent(f"""
+        <example>
+            <query>
+                "{text}"
+            </query>
+            <label>
+                {label}
+            </label>
+        </example>
+        """)
+
+
+# The RAG prompt variants all show the same retrieved examples for a ticket, so the
+# search and the rendered <examples> block are computed once per ticket text and
+# shared by every variant within a run.
+@functools.lru_cache(maxsize=4096)
+def _render_examples(ticket, k=5):
+    return "".join(
+        _render_example(example["metadata"]["text"], example["metadata"]["label"])
+        for example in vectordb.search(ticket, k)
+    )
+
+
 def simple_classify(context: dict):
     X = context['vars']['text']
     prompt = textwrap.dedent("""
@@ -77,19 +117,7 @@ def simple_classify(context: dict):
 
 def rag_classify(context: dict):
     X = context['vars']['text']
-    rag = vectordb.search(X,5)
-    rag_string = ""
-    for example in rag:
-        rag_string += textwrap.dedent(f"""
-        <example>
-            <query>
-                "{example["metadata"]["text"]}"
-            </query>
-            <label>
-                {example["metadata"]["label"]}
-            </label>
-        </example>
-        """)
+    rag_string = _render_examples(X, 5)
     prompt = textwrap.dedent("""
     You will classify a customer support ticket into one of the following categories:
     <categories>
@@ -113,19 +141,7 @@ def rag_classify(context: dict):
 
 def rag_chain_of_thought_classify(context: dict):
     X = context['vars']['text']
-    rag = vectordb.search(X,5)
-    rag_string = ""
-    for example in rag:
-        rag_string += textwrap.dedent(f"""
-        <example>
-            <query>
-                "{example["metadata"]["text"]}"
-            </query>
-            <label>
-                {example["metadata"]["label"]}
-            </label>
-        </example>
-        """)
+    rag_string = _render_examples(X, 5)
     prompt = textwrap.dedent("""
     You will classify a customer support ticket into one of the following categories:
     <categories>
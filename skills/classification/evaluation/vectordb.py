@@ -1,82 +1,198 @@
 import os
 import numpy as np
-import voyageai
 import pickle
 import json
+import threading
+from embeddings import DEFAULT_MODEL, get_embedder
+from ingest import embed_batches
+from query_cache import open_query_cache
+
+# On-disk layout of the store directory. Bump when the layout changes.
+FORMAT_VERSION = 1
+
+
+def _write_atomic(path, write):
+    # Write to a temp file and rename it over the target so a reader never sees a partial file.
+    # The temp name is unique per process and thread, so concurrent writers never share one.
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        write(file)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, obj):
+    _write_atomic(path, lambda file: file.write(json.dumps(obj, separators=(",", ":")).encode("utf-8")))
+
 
 class VectorDB:
-    def __init__(self, api_key=None):
-        if api_key is None:
-            api_key = os.getenv("VOYAGE_API_KEY")
-        self.client = voyageai.Client(api_key=api_key)
-        self.embeddings = []
+    # Metadata fields indexed for `where` filters at load time
+    filter_fields = ("label",)
+
+    def __init__(self, api_key=None, embedder=None, query_cache_path=None):
+        # Voyage by default, or the provider named by EMBEDDING_PROVIDER (see embeddings.py)
+        self.embedder = embedder if embedder is not None else get_embedder(api_key=api_key)
+        self.embeddings = np.empty((0, 0), dtype=np.float32)
         self.metadata = []
-        self.query_cache = {}
-        self.db_path = "../data/vector_db.pkl"
+        self.metadata_index = {}
+        self.db_path = "../data/vector_db"
+        # Stores embedded with a non-default model live next to the default one
+        if self.embedder.model != DEFAULT_MODEL:
+            self.db_path = f"{self.db_path}-{self.embedder.model}"
+        self.legacy_db_path = f"{self.db_path}.pkl"
+        # Bounded LRU of query embeddings in SQLite, shareable with the other skills via QUERY_CACHE_PATH
+        self.query_cache = open_query_cache(query_cache_path, default_path=os.path.join(self.db_path, "query_cache.sqlite"))
 
     def load_data(self, data):
         # Check if the vector database is already loaded
-        if self.embeddings and self.metadata:
+        if len(self.embeddings) and self.metadata:
             print("Vector database is already loaded. Skipping data loading.")
             return
-        # Check if vector_db.pkl exists
-        if os.path.exists(self.db_path):
+        # Check if a saved vector database exists
+        if os.path.exists(os.path.join(self.db_path, "manifest.json")) or os.path.exists(self.legacy_db_path):
             print("Loading vector database from disk.")
             self.load_db()
             return
 
         texts = [item["text"] for item in data]
 
-        # Embed more than 128 documents with a for loop
-        batch_size = 128
-        result = [
-            self.client.embed(
-                texts[i : i + batch_size],
-                model="voyage-2"
-            ).embeddings
-            for i in range(0, len(texts), batch_size)
-        ]
-
-        # Flatten the embeddings
-        self.embeddings = [embedding for batch in result for embedding in batch]
+        # Embed batches of 128 documents concurrently, with retries and a checkpoint per batch
+        self.embeddings = embed_batches(
+            self.embedder.embed,
+            texts,
+            checkpoint_dir=f"{self.db_path}.ingest",
+        )
         self.metadata = [item for item in data]
+        self._build_metadata_index()
         # Save the vector database to disk
         print("Vector database loaded and saved.")
 
-    def search(self, query, k=5, similarity_threshold=0.85):
-        query_embedding = None
-        if query in self.query_cache:
-            query_embedding = self.query_cache[query]
-        else:
-            query_embedding = self.client.embed([query], model="voyage-2").embeddings[0]
-            self.query_cache[query] = query_embedding
+    def _build_metadata_index(self):
+        self.metadata_index = {}
+        for field in self.filter_fields:
+            self._postings(field)
+
+    def _postings(self, field):
+        # Inverted index from each value of a metadata field to the sorted ids of the
+        # rows holding it. Fields outside `filter_fields` are indexed on first use.
+        if field not in self.metadata_index:
+            postings = {}
+            for row, item in enumerate(self.metadata):
+                value = item.get(field)
+                if isinstance(value, str | int | float | bool):
+                    postings.setdefault(value, []).append(row)
+            self.metadata_index[field] = {value: np.array(ids, dtype=np.int64) for value, ids in postings.items()}
+        return self.metadata_index[field]
+
+    def _filter_rows(self, where):
+        # Rows matching every field of `where`; a list of values matches any of them
+        rows = None
+        for field, wanted in where.items():
+            postings = self._postings(field)
+            values = wanted if isinstance(wanted, list | tuple | set | frozenset) else [wanted]
+            matches = [postings[value] for value in values if value in postings]
+            matched = np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int64)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return rows
+
+    def search(self, query, k=5, similarity_threshold=0.85, where=None):
+        # Thresholds are on the voyage-2 scale (see embeddings.py)
+        similarity_threshold *= getattr(self.embedder, "similarity_scale", 1.0)
+        # Concurrent searches for the same uncached query share one embed request
+        query_embedding = self.query_cache.get_many(self.embedder.model, [query], self.embedder.embed)[query]
+        self.query_cache.maybe_flush()
 
-        if not self.embeddings:
+        if not len(self.embeddings):
             raise ValueError("No data loaded in the vector database.")
 
-        similarities = np.dot(self.embeddings, query_embedding)
+        # Score only the rows whose metadata matches `where`, e.g. {"label": "Billing Inquiries"}
+        rows = np.arange(len(self.embeddings)) if where is None else self._filter_rows(where)
+        similarities = np.dot(self.embeddings if where is None else self.embeddings[rows], query_embedding)
         top_indices = np.argsort(similarities)[::-1]
         top_examples = []
-        
+
         for idx in top_indices:
             if similarities[idx] >= similarity_threshold:
                 example = {
-                    "metadata": self.metadata[idx],
+                    "metadata": self.metadata[rows[idx]],
                     "similarity": similarities[idx],
                 }
                 top_examples.append(example)
-                
+
                 if len(top_examples) >= k:
                     break
-        
+
         return top_examples
 
+    def search_many(self, queries, k=5, similarity_threshold=0.85, where=None):
+        # Thresholds are on the voyage-2 scale (see embeddings.py)
+        similarity_threshold *= getattr(self.embedder, "similarity_scale", 1.0)
+        # Embed all uncached queries in batched requests
+        query_embeddings = self.query_cache.get_many(self.embedder.model, queries, self.embedder.embed)
+        self.query_cache.maybe_flush()
+
+        if not len(self.embeddings):
+            raise ValueError("No data loaded in the vector database.")
+
+        # Score every query against the whole database with one matrix-matrix product
+        query_embeddings = np.array([query_embeddings[query] for query in queries], dtype=np.float32)
+        query_embeddings = query_embeddings.reshape(len(queries), self.embeddings.shape[1])
+        rows = np.arange(len(self.embeddings)) if where is None else self._filter_rows(where)
+        matrix = np.asarray(self.embeddings if where is None else self.embeddings[rows])
+        similarities = query_embeddings @ matrix.T
+        results = []
+        for row in similarities:
+            top_indices = np.argsort(row)[::-1][:k]
+            results.append([
+                {"metadata": self.metadata[rows[idx]], "similarity": row[idx]}
+                for idx in top_indices if row[idx] >= similarity_threshold
+            ])
+        return results
+
+    def save_db(self):
+        os.makedirs(self.db_path, exist_ok=True)
+        embeddings = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+        _write_atomic(os.path.join(self.db_path, "embeddings.npy"), lambda file: np.save(file, embeddings))
+        _write_json(os.path.join(self.db_path, "metadata.json"), self.metadata)
+        self.query_cache.flush()
+        # The manifest is written last, so a store without one is incomplete
+        _write_json(
+            os.path.join(self.db_path, "manifest.json"),
+            {"format_version": FORMAT_VERSION, "count": len(embeddings), "dtype": "float32", "model": self.embedder.model},
+        )
+
     def load_db(self):
-        if not os.path.exists(self.db_path):
+        manifest_path = os.path.join(self.db_path, "manifest.json")
+        if not os.path.exists(manifest_path):
+            if os.path.exists(self.legacy_db_path):
+                # One-time conversion of the pickled store into the directory layout
+                print(f"Converting {self.legacy_db_path} to the memory-mapped store format.")
+                with open(self.legacy_db_path, "rb") as file:
+                    data = pickle.load(file)
+                self.embeddings = np.array(data["embeddings"], dtype=np.float32)
+                self.metadata = data["metadata"]
+                self._build_metadata_index()
+                for query, embedding in json.loads(data["query_cache"]).items():
+                    self.query_cache.put(self.embedder.model, query, embedding)
+                self.save_db()
+                return
             raise ValueError("Vector database file not found. Use load_data to create a new database.")
-        
-        with open(self.db_path, "rb") as file:
-            data = pickle.load(file)
-        self.embeddings = data["embeddings"]
-        self.metadata = data["metadata"]
-        self.query_cache = json.loads(data["query_cache"])
\ No newline at end of file
+
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector database format version {manifest.get('format_version')}, expected {FORMAT_VERSION}.")
+        if manifest.get("model", DEFAULT_MODEL) != self.embedder.model:
+            raise ValueError(f"{self.db_path} was embedded with {manifest.get('model', DEFAULT_MODEL)}, not {self.embedder.model}.")
+        # Memory-map the matrix read-only so it is shared through the page cache
+        self.embeddings = np.load(os.path.join(self.db_path, "embeddings.npy"), mmap_mode="r")
+        with open(os.path.join(self.db_path, "metadata.json")) as file:
+            self.metadata = json.load(file)
+        self._build_metadata_index()
+        # Move query embeddings from the older single-file cache into the SQLite cache
+        legacy_query_cache_path = os.path.join(self.db_path, "query_cache.json")
+        if os.path.exists(legacy_query_cache_path):
+            with open(legacy_query_cache_path) as file:
+                for query, embedding in json.load(file).items():
+                    self.query_cache.put(self.embedder.model, query, embedding)
+            self.query_cache.flush()
+            os.remove(legacy_query_cache_path)
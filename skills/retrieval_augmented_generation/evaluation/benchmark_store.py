@@ -0,0 +1,37 @@
+"""How ../../vectordb_benchmark.py opens, fills, reloads and searches this skill's VectorDB."""
+
+import os
+
+from vectordb import VectorDB, _content_hash
+
+NAME = "retrieval_augmented_generation"
+
+
+# VectorDB(name) writes ./data/<name>/ below the working directory.
+def open_store(root, embedder):
+    return VectorDB(
+        "benchmark", embedder=embedder, query_cache_path=os.path.join(root, "query_cache.sqlite")
+    )
+
+
+def build_store(db, embeddings, metadata):
+    # What load_data persists besides the matrix: the content hashes and every index
+    # derived from the rows (metadata filters, BM25), so load_db finds
+    # them on disk instead of rebuilding them.
+    db.embeddings, db.metadata = embeddings, metadata
+    db.content_hashes = [_content_hash(db._format_text(item)) for item in metadata]
+    db._build_indexes()
+
+
+def load_store(root, embedder):
+    db = open_store(root, embedder)
+    db.load_db()
+    return db
+
+
+def search(db, query, k):
+    return db.search(query, k=k, similarity_threshold=-1.0)
+
+
+def search_many(db, queries, k):
+    return db.search_many(queries, k=k, similarity_threshold=-1.0)
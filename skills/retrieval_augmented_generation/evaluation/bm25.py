@@ -0,0 +1,126 @@
+"""In-process BM25 lexical index and rank fusion for hybrid retrieval.
+
+The index is a term -> postings table in CSR form: the postings of term t are
+doc_ids[indptr[t]:indptr[t + 1]]. Each posting stores its precomputed BM25 weight,
+idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avg_doc_len)), so scoring a
+query only adds the postings slices of its terms into one score vector.
+"""
+
+import re
+from collections import Counter
+
+import numpy as np
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    def __init__(self, terms, indptr, doc_ids, weights, count):
+        self.terms = list(terms)
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.count = int(count)
+
+    @classmethod
+    def build(cls, texts, k1=1.2, b=0.75):
+        vocabulary = {}
+        term_ids, doc_ids, term_freqs = [], [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc)
+                term_freqs.append(tf)
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+        term_freqs = np.array(term_freqs, dtype=np.float32)
+
+        # Group the postings by term; the stable sort keeps each term's docs in row order.
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, doc_ids, term_freqs = term_ids[order], doc_ids[order], term_freqs[order]
+        document_frequency = np.bincount(term_ids, minlength=len(vocabulary))
+        indptr = np.concatenate([[0], np.cumsum(document_frequency)]).astype(np.int64)
+
+        count = len(texts)
+        idf = np.log1p((count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(
+            np.float32
+        )
+        average_length = doc_lengths.mean() if count and doc_lengths.mean() > 0 else 1.0
+        norms = k1 * (1 - b + b * doc_lengths[doc_ids] / average_length)
+        weights = idf[term_ids] * term_freqs * (k1 + 1) / (term_freqs + norms)
+        terms = sorted(vocabulary, key=vocabulary.get)
+        return cls(terms, indptr, doc_ids.astype(np.int32), weights.astype(np.float32), count)
+
+    def scores(self, query, rows=None):
+        """BM25 score of every row for `query`, or of `rows` only."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                start, stop = self.indptr[term_id], self.indptr[term_id + 1]
+                scores[self.doc_ids[start:stop]] += self.weights[start:stop]
+        return scores if rows is None else scores[rows]
+
+    def top_k(self, query, k, rows=None):
+        """(row ids, scores) of the best k rows that share at least one term with `query`."""
+        scores = self.scores(query, rows)
+        candidates = np.flatnonzero(scores > 0)
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return (candidates if rows is None else rows[candidates]), scores[candidates]
+
+    def reordered(self, order):
+        """The same index with its documents renumbered: document order[i] becomes row i."""
+        new_rows = np.empty(self.count, dtype=self.doc_ids.dtype)
+        new_rows[order] = np.arange(self.count)
+        return BM25Index(self.terms, self.indptr, new_rows[self.doc_ids], self.weights, self.count)
+
+    def save(self, file):
+        np.savez(
+            file,
+            terms=np.array(self.terms, dtype=str),
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            weights=self.weights,
+            count=self.count,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["terms"].tolist(),
+                data["indptr"],
+                data["doc_ids"],
+                data["weights"],
+                data["count"],
+            )
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """Fused scores by row id: the sum of 1 / (rrf_k + rank) over the rankings that contain the row."""
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (rrf_k + rank)
+    return fused
+
+
+def weighted_fusion(scored_lists, weights):
+    """Fused scores by row id: the weighted sum of each list's min-max normalized scores."""
+    fused = {}
+    for (rows, scores), weight in zip(scored_lists, weights, strict=False):
+        if not len(rows):
+            continue
+        low, high = float(np.min(scores)), float(np.max(scores))
+        normalized = (np.asarray(scores) - low) / (high - low) if high > low else np.ones(len(rows))
+        for row, score in zip(rows, normalized, strict=False):
+            fused[int(row)] = fused.get(int(row), 0.0) + weight * float(score)
+    return fused
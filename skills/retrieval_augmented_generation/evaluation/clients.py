@@ -0,0 +1,104 @@
+"""Process-wide Anthropic client with a shared keep-alive connection pool.
+
+Creating an `Anthropic` client per call opens a new connection pool, so every
+rerank or grading request pays for a fresh TCP and TLS handshake. `get_client()`
+returns one client per process instead, and requests reuse its idle connections.
+
+Async requests share one process too. An httpx async pool and an asyncio
+semaphore belong to the event loop they were created on, and promptfoo runs each
+call of an async provider in a fresh `asyncio.run`, so this module owns one
+background event loop for the process instead. `on_client_loop(coroutine)` runs a
+coroutine there and awaits it from any thread or event loop; inside it,
+`get_async_client()` is the process's `AsyncAnthropic` client and
+`get_semaphore()` bounds the requests in flight across every caller.
+
+The pool can be sized with environment variables:
+
+    ANTHROPIC_MAX_CONNECTIONS            open connections at once (default 32)
+    ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS  idle connections kept open (default 32)
+    ANTHROPIC_KEEPALIVE_EXPIRY           seconds an idle connection is kept (default 60)
+    ANTHROPIC_MAX_RETRIES                retries on rate limits and overload (default 2)
+    EVAL_MAX_CONCURRENCY                 async requests in flight per process (default 32)
+"""
+
+import asyncio
+import os
+import threading
+
+import httpx
+from anthropic import Anthropic, AsyncAnthropic, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+_client = None
+_async_client = None
+_semaphore = None
+_loop = None
+_lock = threading.Lock()
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "32")),
+        max_keepalive_connections=int(os.getenv("ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", "32")),
+        keepalive_expiry=float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY", "60")),
+    )
+
+
+def get_client():
+    """The shared Anthropic client, created on first use. Safe to use from any thread."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = Anthropic(
+                api_key=os.environ.get("ANTHROPIC_API_KEY"),
+                max_retries=int(os.getenv("ANTHROPIC_MAX_RETRIES", "2")),
+                http_client=DefaultHttpxClient(limits=_limits()),
+            )
+        return _client
+
+
+def _client_loop():
+    # The process's background event loop, started on first use.
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="anthropic-client-loop", daemon=True
+            ).start()
+        return _loop
+
+
+async def on_client_loop(coroutine):
+    """Run `coroutine` on the process's client loop and return its result, from any event loop."""
+    loop = _client_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coroutine
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+
+def get_async_client():
+    """The process's AsyncAnthropic client. Only use it in coroutines run by `on_client_loop`."""
+    global _async_client
+    if asyncio.get_running_loop() is not _loop:
+        raise RuntimeError(
+            "get_async_client() must be called from a coroutine run by on_client_loop()."
+        )
+    if _async_client is None:
+        _async_client = AsyncAnthropic(
+            api_key=os.environ.get("ANTHROPIC_API_KEY"),
+            max_retries=int(os.getenv("ANTHROPIC_MAX_RETRIES", "2")),
+            http_client=DefaultAsyncHttpxClient(limits=_limits()),
+        )
+    return _async_client
+
+
+def get_semaphore():
+    """The semaphore bounding the async requests in flight in the process (EVAL_MAX_CONCURRENCY)."""
+    global _semaphore
+    if asyncio.get_running_loop() is not _loop:
+        raise RuntimeError(
+            "get_semaphore() must be called from a coroutine run by on_client_loop()."
+        )
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(int(os.getenv("EVAL_MAX_CONCURRENCY", "32")))
+    return _semaphore
@@ -0,0 +1,49 @@
+"""Prompt context from ranked search results, with an optional token budget.
+
+`build_context` renders the results best first and joins them. Without a budget
+(the default) every result is used. With one (`max_tokens`, or CONTEXT_MAX_TOKENS
+when set), whole chunks are kept while they fit, and the first chunk that does not
+fit has its text truncated to the tokens left, after which packing stops. The
+best-ranked chunks therefore always reach the prompt, and prompts have a
+predictable upper bound on input tokens however long the retrieved chunks are.
+
+Sizes are estimated on the rendered text, at about 4 characters per token (see
+ingest.estimate_tokens). Each prompt renders chunks differently, and only the few
+retrieved chunks are measured per query, so no counts are stored with the VectorDB.
+"""
+
+import os
+
+from ingest import estimate_tokens
+
+DEFAULT_MAX_TOKENS = (
+    int(os.environ["CONTEXT_MAX_TOKENS"]) if os.getenv("CONTEXT_MAX_TOKENS") else None
+)
+
+
+def _truncated(chunk, render, max_tokens):
+    # The chunk rendered with as much of its text as fits in max_tokens, or None.
+    overhead = estimate_tokens([render({**chunk, "text": ""})])
+    characters = (max_tokens - overhead) * 4
+    if characters <= 0:
+        return None
+    return render({**chunk, "text": chunk["text"][:characters]})
+
+
+def build_context(results, render, max_tokens=DEFAULT_MAX_TOKENS):
+    """(used results, context string, estimated tokens) for the results that fit in max_tokens."""
+    packed, parts, used = [], [], 0
+    for result in results:
+        text = render(result["metadata"])
+        tokens = estimate_tokens([text])
+        if max_tokens is not None and used + tokens > max_tokens:
+            text = _truncated(result["metadata"], render, max_tokens - used)
+            if text is not None:
+                packed.append(result)
+                parts.append(text)
+                used += estimate_tokens([text])
+            break
+        packed.append(result)
+        parts.append(text)
+        used += tokens
+    return packed, "".join(parts), used
@@ -1,5 +1,9 @@
-from typing import Dict, Union, Any, List
+from typing import Dict, Union, Any, List, Optional, Sequence
+import argparse
 import ast
+import json
+
+import numpy as np
 
 def calculate_mrr(retrieved_links: List[str], correct_links) -> float:
     for i, link in enumerate(retrieved_links, 1):
@@ -109,4 +113,137 @@ def get_assert(output: str, context) -> Union[bool, float, Dict[str, Any]]:
                     }
                 },
             ],
-        }
\ No newline at end of file
+        }
+
+# Whole-run scoring. `get_assert` above scores one promptfoo row at a time; the
+# functions below score every query of a run at once. Chunk links are encoded as
+# integer ids, a run becomes a (queries, depth) matrix of ids padded with -1, and
+# each metric is a vectorized reduction over the matrix of hits, so a 10k-query
+# sweep scores in milliseconds.
+
+class GoldenSet:
+    """The correct chunk links of every query, parsed once and encoded as ids."""
+
+    def __init__(self, correct_chunks: Sequence[Union[str, Sequence[str]]]):
+        self.link_ids: Dict[str, int] = {}
+        query_ids, link_ids = [], []
+        for query, links in enumerate(correct_chunks):
+            if isinstance(links, str):
+                links = ast.literal_eval(links)
+            for link in dict.fromkeys(links):
+                query_ids.append(query)
+                link_ids.append(self._id(link))
+        self.size = len(correct_chunks)
+        # Sorted (query, link) pair keys, so a lookup of a whole matrix is one searchsorted.
+        self._pairs = np.sort(self._pair_keys(np.array(query_ids, dtype=np.int64), np.array(link_ids, dtype=np.int64)))
+        self.relevant_counts = np.bincount(np.array(query_ids, dtype=np.int64), minlength=self.size)
+
+    def _id(self, link: str) -> int:
+        return self.link_ids.setdefault(link, len(self.link_ids))
+
+    @staticmethod
+    def _pair_keys(query_ids: np.ndarray, link_ids: np.ndarray) -> np.ndarray:
+        return (query_ids << 32) | link_ids
+
+    def encode(self, rankings: Sequence[Sequence[str]], depth: Optional[int] = None) -> np.ndarray:
+        """(queries, depth) int matrix of the retrieved link ids, best first, padded with -1."""
+        if len(rankings) != self.size:
+            raise ValueError(f"Expected {self.size} rankings, got {len(rankings)}.")
+        depth = depth or max((len(links) for links in rankings), default=0)
+        ranked = np.full((self.size, depth), -1, dtype=np.int64)
+        for query, links in enumerate(rankings):
+            links = links[:depth]
+            ranked[query, : len(links)] = [self._id(link) for link in links]
+        return ranked
+
+    def hits(self, ranked: np.ndarray) -> np.ndarray:
+        """Boolean matrix marking the first retrieval of each correct link."""
+        if not len(self._pairs):
+            return np.zeros(ranked.shape, dtype=bool)
+        queries = np.arange(len(ranked), dtype=np.int64)[:, None]
+        keys = self._pair_keys(np.broadcast_to(queries, ranked.shape), np.maximum(ranked, 0))
+        positions = np.minimum(np.searchsorted(self._pairs, keys), len(self._pairs) - 1)
+        relevant = (ranked >= 0) & (self._pairs[positions] == keys)
+        # A link retrieved twice counts once, at its first rank, as in evaluate_retrieval.
+        # A stable row sort puts repeats right after their first occurrence.
+        order = np.argsort(ranked, axis=1, kind="stable")
+        ordered = np.take_along_axis(ranked, order, axis=1)
+        repeats = np.zeros(ranked.shape, dtype=bool)
+        repeats[:, 1:] = ordered[:, 1:] == ordered[:, :-1]
+        earlier = np.zeros(ranked.shape, dtype=bool)
+        np.put_along_axis(earlier, order, repeats, axis=1)
+        return relevant & ~earlier
+
+
+def score_run(golden: GoldenSet, ranked: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-query metrics of a ranked id matrix from `GoldenSet.encode`.
+
+    precision, recall, f1 and mrr match `evaluate_retrieval` on each row.
+    recall_at_k, precision_at_k and ndcg_at_k have one column per k = 1..depth.
+    """
+    hits = golden.hits(ranked)
+    depth = ranked.shape[1]
+    retrieved = (ranked >= 0).sum(axis=1)
+    relevant = golden.relevant_counts
+    found = np.cumsum(hits, axis=1, dtype=np.float64)
+    true_positives = found[:, -1] if depth else np.zeros(len(ranked))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(retrieved > 0, true_positives / retrieved, 0.0)
+        recall = np.where(relevant > 0, true_positives / relevant, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        recall_at_k = np.where(relevant[:, None] > 0, found / relevant[:, None], 0.0)
+    first_hit = hits.argmax(axis=1) if depth else np.zeros(len(ranked), dtype=np.int64)
+    mrr = np.where(hits.any(axis=1), 1.0 / (first_hit + 1), 0.0)
+
+    # Binary-gain nDCG@k: the DCG of the hits over the DCG of min(k, relevant) hits at the top.
+    discounts = 1.0 / np.log2(np.arange(depth) + 2)
+    dcg = np.cumsum(hits * discounts, axis=1)
+    ideal_discounts = np.concatenate([[0.0], np.cumsum(discounts)])
+    ideal = ideal_discounts[np.minimum(np.arange(1, depth + 1)[None, :], relevant[:, None])]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndcg_at_k = np.where(ideal > 0, dcg / ideal, 0.0)
+
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "mrr": mrr,
+        "recall_at_k": recall_at_k,
+        "precision_at_k": found / np.arange(1, depth + 1),
+        "ndcg_at_k": ndcg_at_k,
+    }
+
+
+def summarize_run(golden: GoldenSet, rankings: Sequence[Sequence[str]], depth: Optional[int] = None) -> Dict[str, Any]:
+    """Mean metrics of a whole run, given the retrieved links of every query in golden order."""
+    scores = score_run(golden, golden.encode(rankings, depth))
+    summary: Dict[str, Any] = {name: float(values.mean()) for name, values in scores.items() if values.ndim == 1}
+    for name in ("recall_at_k", "precision_at_k", "ndcg_at_k"):
+        summary[name] = {k: float(value) for k, value in enumerate(scores[name].mean(axis=0), start=1)}
+    summary["queries"] = golden.size
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a store's retrieval over the whole golden dataset.")
+    parser.add_argument("--store", default="anthropic_docs", help="store name from stores.STORES")
+    parser.add_argument("--dataset", default="docs_evaluation_dataset.json")
+    parser.add_argument("--k", type=int, default=20, help="retrieval depth")
+    parser.add_argument("--threshold", type=float, default=0.0, help="minimum similarity of a result")
+    args = parser.parse_args()
+
+    from stores import get_store
+
+    with open(args.dataset) as f:
+        dataset = json.load(f)
+    golden = GoldenSet([item["correct_chunks"] for item in dataset])
+    results = get_store(args.store).search_many(
+        [item["question"] for item in dataset], k=args.k, similarity_threshold=args.threshold
+    )
+    rankings = [[result["metadata"]["chunk_link"] for result in query_results] for query_results in results]
+    print(json.dumps(summarize_run(golden, rankings, args.k), indent=2))
+
+
+if __name__ == "__main__":
+    main()
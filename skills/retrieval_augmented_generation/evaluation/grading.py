@@ -0,0 +1,359 @@
+"""LLM grading of end to end answers, with a persistent verdict cache.
+
+A grade sends the question, the correct answer and the generated answer to Claude
+and gets back an explanation and a true/false verdict. The verdict only depends on
+the grading request, so it is stored in SQLite under a hash of the request (model,
+prompt and sampling parameters). Re-running an eval only grades the answers that
+changed, and editing the grading prompt invalidates every stored verdict.
+
+Rows can be graded one at a time (`grade`, `agrade`), or in bulk with
+`grade_many`: "async" mode keeps up to EVAL_MAX_CONCURRENCY requests in flight
+(see clients.py), and "batch" mode submits the uncached rows as one Message Batch,
+which costs less for large sweeps but may take a while to complete:
+
+    python grading.py answers.json --mode batch --output graded.json
+
+where answers.json is a list of {"question", "correct_answer", "generated_answer"}
+objects.
+
+Single grades can be streamed (see streaming.py). The streamed prompt asks for
+the verdict before the explanation, and the stream stops once the fields the
+GRADE_STREAM mode needs are closed: right after the verdict in "verdict" mode, or
+after the explanation in "explain" mode. Batches are not streamed.
+
+Environment variables:
+
+    GRADE_CACHE_PATH  cache file (default ./data/grade_cache.sqlite)
+    GRADE_CACHE       "on" (default), "refresh" to ignore stored verdicts and
+                      overwrite them, or "off" to neither read nor write
+    GRADE_STREAM      "off" (default, one blocking request), "verdict" or "explain"
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from clients import get_async_client, get_client, get_semaphore, on_client_loop
+from streaming import astream_until, fields_closed, stream_until
+
+GRADER_MODEL = "claude-3-5-sonnet-20241022"
+DEFAULT_PATH = "./data/grade_cache.sqlite"
+MODES = ("on", "refresh", "off")
+
+_open_caches = {}
+_open_caches_lock = threading.Lock()
+
+
+# Blocking grades keep the original explanation-first format. Streamed grades ask for
+# the verdict first, so the stream can stop right after it.
+RESPONSE_FORMATS = {
+    False: """Respond in the following XML format:
+    <evaluation>
+    <content>
+    <explanation>Your explanation here</explanation>
+    <is_correct>true/false</is_correct>
+    </content>
+    </evaluation>
+""",
+    True: """Respond in the following XML format, giving your verdict before your explanation:
+    <evaluation>
+    <content>
+    <is_correct>true/false</is_correct>
+    <explanation>Your explanation here</explanation>
+    </content>
+    </evaluation>
+""",
+}
+PREFILLS = {False: "<evaluation>", True: "<evaluation>\n<content>\n<is_correct>"}
+
+# GRADE_STREAM mode -> fields that must be closed before a streamed grade stops
+STREAM_FIELDS = {"verdict": ("is_correct",), "explain": ("is_correct", "explanation")}
+
+
+def _stream_mode():
+    mode = os.getenv("GRADE_STREAM", "off")
+    if mode != "off" and mode not in STREAM_FIELDS:
+        raise ValueError(
+            f"Unknown grade stream mode {mode!r}, expected 'off' or one of {sorted(STREAM_FIELDS)}."
+        )
+    return mode
+
+
+def grading_request(query, generated_answer, correct_answer, verdict_first=False):
+    """Messages API parameters of the grading request for one answer."""
+    prompt = f"""
+    You are an AI assistant tasked with evaluating the correctness of answers to questions about Anthropic's documentation.
+    
+    Question: {query}
+    
+    Correct Answer: {correct_answer}
+    
+    Generated Answer: {generated_answer}
+    
+    Is the Generated Answer correct based on the Correct Answer? You should pay attention to the substance of the answer, and ignore minute details that may differ. 
+    
+    Small differences or changes in wording don't matter. If the generated answer and correct answer are saying essentially the same thing then that generated answer should be marked correct. 
+    
+    However, if there is any critical piece of information which is missing from the generated answer in comparison to the correct answer, then we should mark this as incorrect. 
+    
+    Finally, if there are any direct contradictions between the correct answer and generated answer, we should deem the generated answer to be incorrect.
+    
+    {RESPONSE_FORMATS[verdict_first]}    """  # noqa: W291, W293 (the prompt is kept byte-for-byte)
+    return {
+        "model": GRADER_MODEL,
+        "max_tokens": 1500,
+        "messages": [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": PREFILLS[verdict_first]},
+        ],
+        "temperature": 0,
+        "stop_sequences": ["</evaluation>"],
+    }
+
+
+def parse_verdict(response_text, require_explanation=True):
+    """(is_correct, explanation) from the text of a grading response."""
+    explanation_match = re.search(r"<explanation>(.*?)</explanation>", response_text, re.DOTALL)
+    is_correct_match = re.search(r"<is_correct>(.*?)</is_correct>", response_text, re.DOTALL)
+    if not is_correct_match or (require_explanation and not explanation_match):
+        raise ValueError("Could not extract explanation or is_correct from response")
+    explanation = (
+        explanation_match.group(1).strip()
+        if explanation_match
+        else "(verdict only, GRADE_STREAM=verdict)"
+    )
+    return is_correct_match.group(1).strip().lower() == "true", explanation
+
+
+def _request_key(request, mode="off"):
+    # Streamed grades may stop before the explanation, so their verdicts are stored
+    # apart from full ones.
+    if mode != "off":
+        request = {**request, "stream_fields": STREAM_FIELDS[mode]}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _result(query, generated_answer, correct_answer, is_correct, explanation):
+    return {
+        "question": query,
+        "correct_answer": correct_answer,
+        "generated_answer": generated_answer,
+        "is_correct": is_correct,
+        "explanation": explanation,
+    }
+
+
+def _error_result(query, generated_answer, correct_answer, error):
+    print(f"Unexpected error: {error}")
+    return _result(
+        query, generated_answer, correct_answer, False, f"Unexpected error: {str(error)}"
+    )
+
+
+class VerdictCache:
+    def __init__(self, path, mode="on"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown grade cache mode {mode!r}, expected one of {MODES}.")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, is_correct INTEGER NOT NULL, explanation TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()
+            return count
+
+    def get(self, key):
+        """The stored (is_correct, explanation) for a request key, or None."""
+        if self.mode != "on":
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT is_correct, explanation FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return bool(row[0]), row[1]
+
+    def put(self, key, is_correct, explanation):
+        if self.mode == "off":
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO verdicts (key, is_correct, explanation, created) VALUES (?, ?, ?, ?)",
+                (key, int(is_correct), explanation, time.time()),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM verdicts")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+            "mode": self.mode,
+        }
+
+
+def open_verdict_cache(path=None):
+    """The process-wide cache for `path` (or GRADE_CACHE_PATH, or DEFAULT_PATH)."""
+    path = os.path.abspath(path or os.getenv("GRADE_CACHE_PATH") or DEFAULT_PATH)
+    with _open_caches_lock:
+        if path not in _open_caches:
+            _open_caches[path] = VerdictCache(path, mode=os.getenv("GRADE_CACHE", "on"))
+        return _open_caches[path]
+
+
+def grade(query, generated_answer, correct_answer):
+    """Grade one answer, reusing the stored verdict when this exact request ran before."""
+    mode = _stream_mode()
+    request = grading_request(query, generated_answer, correct_answer, verdict_first=mode != "off")
+    key = _request_key(request, mode)
+    cache = open_verdict_cache()
+    try:
+        verdict = cache.get(key)
+        if verdict is None:
+            if mode == "off":
+                response_text = get_client().messages.create(**request).content[0].text
+            else:
+                response_text = stream_until(
+                    get_client(), request, fields_closed(*STREAM_FIELDS[mode])
+                )
+            verdict = parse_verdict(response_text, require_explanation=mode != "verdict")
+            cache.put(key, *verdict)
+        return _result(query, generated_answer, correct_answer, *verdict)
+    except Exception as e:
+        return _error_result(query, generated_answer, correct_answer, e)
+
+
+async def _agrade_text(request, mode):
+    # Runs on the process's client loop, so every caller shares its client and semaphore.
+    async with get_semaphore():
+        if mode == "off":
+            return (await get_async_client().messages.create(**request)).content[0].text
+        return await astream_until(get_async_client(), request, fields_closed(*STREAM_FIELDS[mode]))
+
+
+async def agrade(query, generated_answer, correct_answer):
+    """Coroutine version of `grade`; requests share the process's semaphore (see clients.py)."""
+    mode = _stream_mode()
+    request = grading_request(query, generated_answer, correct_answer, verdict_first=mode != "off")
+    key = _request_key(request, mode)
+    cache = open_verdict_cache()
+    try:
+        verdict = cache.get(key)
+        if verdict is None:
+            response_text = await on_client_loop(_agrade_text(request, mode))
+            verdict = parse_verdict(response_text, require_explanation=mode != "verdict")
+            cache.put(key, *verdict)
+        return _result(query, generated_answer, correct_answer, *verdict)
+    except Exception as e:
+        return _error_result(query, generated_answer, correct_answer, e)
+
+
+async def _agrade_all(rows):
+    return await asyncio.gather(*(agrade(*row) for row in rows))
+
+
+def _grade_batch(rows, poll_interval):
+    # Submit every uncached request once (custom_id is the request key), wait for
+    # the batch to end, then fill in the verdicts from its results.
+    cache = open_verdict_cache()
+    requests = [grading_request(*row) for row in rows]
+    keys = [_request_key(request) for request in requests]
+    verdicts = {}
+    for key in keys:
+        if key not in verdicts:
+            verdicts[key] = cache.get(key)
+    missing = {
+        key: request for key, request in zip(keys, requests, strict=False) if verdicts[key] is None
+    }
+    errors = {}
+    if missing:
+        client = get_client()
+        batch = client.messages.batches.create(
+            requests=[{"custom_id": key, "params": request} for key, request in missing.items()]
+        )
+        print(f"Submitted batch {batch.id} with {len(missing)} grading requests")
+        while batch.processing_status != "ended":
+            time.sleep(poll_interval)
+            batch = client.messages.batches.retrieve(batch.id)
+        for entry in client.messages.batches.results(batch.id):
+            try:
+                if entry.result.type != "succeeded":
+                    raise RuntimeError(f"batch request {entry.result.type}")
+                verdicts[entry.custom_id] = parse_verdict(entry.result.message.content[0].text)
+                cache.put(entry.custom_id, *verdicts[entry.custom_id])
+            except Exception as e:
+                errors[entry.custom_id] = e
+    results = []
+    for row, key in zip(rows, keys, strict=False):
+        if verdicts.get(key) is not None:
+            results.append(_result(*row, *verdicts[key]))
+        else:
+            results.append(_error_result(*row, errors.get(key, "no result returned for request")))
+    return results
+
+
+def grade_many(rows, mode="async", poll_interval=30.0):
+    """Grade (query, generated_answer, correct_answer) rows, in order, with "async" or "batch" requests."""
+    rows = [tuple(row) for row in rows]
+    if mode == "async":
+        return asyncio.run(_agrade_all(rows))
+    if mode == "batch":
+        return _grade_batch(rows, poll_interval)
+    raise ValueError(f"Unknown grading mode {mode!r}, expected 'async' or 'batch'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Grade generated answers against the correct answers."
+    )
+    parser.add_argument(
+        "answers", help='JSON list of {"question", "correct_answer", "generated_answer"} objects'
+    )
+    parser.add_argument("--mode", choices=("async", "batch"), default="async")
+    parser.add_argument(
+        "--poll-interval", type=float, default=30.0, help="seconds between batch status checks"
+    )
+    parser.add_argument("--output", help="write the graded rows to this JSON file")
+    args = parser.parse_args()
+
+    with open(args.answers) as f:
+        answers = json.load(f)
+    rows = [
+        (item["question"], item["generated_answer"], item["correct_answer"]) for item in answers
+    ]
+    results = grade_many(rows, mode=args.mode, poll_interval=args.poll_interval)
+    correct = sum(result["is_correct"] for result in results)
+    print(f"Accuracy: {correct}/{len(results)} = {correct / len(results) if results else 0.0:.2%}")
+    print(json.dumps(open_verdict_cache().stats()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
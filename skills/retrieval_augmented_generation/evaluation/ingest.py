@@ -0,0 +1,129 @@
+"""Concurrent, rate-limited batch embedding with retries and resumable checkpoints.
+
+`embed_batches` splits the texts into batches and embeds up to `max_workers` of
+them at a time. Every request first takes its share of a shared request/token
+budget, retryable API errors are retried with jittered exponential backoff, and
+each finished batch is written to a checkpoint directory. If ingestion crashes,
+the next run reloads the finished batches instead of embedding them again.
+"""
+
+import hashlib
+import os
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import voyageai.error
+
+    RETRYABLE_ERRORS = (
+        voyageai.error.RateLimitError,
+        voyageai.error.ServiceUnavailableError,
+        voyageai.error.ServerError,
+        voyageai.error.APIConnectionError,
+        voyageai.error.Timeout,
+        voyageai.error.TryAgain,
+    )
+except ImportError:
+    # Only offline embedders are usable without the voyageai package.
+    RETRYABLE_ERRORS = ()
+
+
+def estimate_tokens(texts):
+    # Rough count (about 4 characters per token), for rate limiting and context budgets.
+    return sum(len(text) for text in texts) // 4 + len(texts)
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and tokens per minute, shared across threads."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute or 0.0
+        self._tokens = tokens_per_minute or 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed_minutes = (now - self._updated) / 60
+                self._updated = now
+                wait = 0.0
+                if self.requests_per_minute:
+                    self._requests = min(
+                        self.requests_per_minute,
+                        self._requests + elapsed_minutes * self.requests_per_minute,
+                    )
+                    wait = max(wait, (1 - self._requests) / self.requests_per_minute * 60)
+                if self.tokens_per_minute:
+                    # A single request larger than the whole budget waits for a full bucket.
+                    needed = min(tokens, self.tokens_per_minute)
+                    self._tokens = min(
+                        self.tokens_per_minute,
+                        self._tokens + elapsed_minutes * self.tokens_per_minute,
+                    )
+                    wait = max(wait, (needed - self._tokens) / self.tokens_per_minute * 60)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self._requests -= 1
+                    if self.tokens_per_minute:
+                        self._tokens -= min(tokens, self.tokens_per_minute)
+                    return
+            time.sleep(wait)
+
+
+def _checkpoint_path(checkpoint_dir, batch):
+    digest = hashlib.sha256("\0".join(batch).encode("utf-8")).hexdigest()
+    return os.path.join(checkpoint_dir, f"{digest}.npy")
+
+
+def embed_batches(
+    embed,
+    texts,
+    batch_size=128,
+    max_workers=4,
+    rate_limiter=None,
+    max_retries=6,
+    initial_backoff=1.0,
+    checkpoint_dir=None,
+):
+    """Embed `texts` with `embed(batch) -> list of vectors` and return one float32 row per text."""
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def run(batch):
+        checkpoint = _checkpoint_path(checkpoint_dir, batch) if checkpoint_dir is not None else None
+        if checkpoint is not None and os.path.exists(checkpoint):
+            return np.load(checkpoint)
+        for attempt in range(max_retries + 1):
+            if rate_limiter is not None:
+                rate_limiter.acquire(estimate_tokens(batch))
+            try:
+                embeddings = np.asarray(embed(batch), dtype=np.float32)
+                break
+            except RETRYABLE_ERRORS:
+                if attempt == max_retries:
+                    raise
+                time.sleep(initial_backoff * 2**attempt * (1 + random.random()))  # noqa: S311 (backoff jitter)
+        if checkpoint is not None:
+            with open(f"{checkpoint}.tmp", "wb") as file:
+                np.save(file, embeddings)
+            os.replace(f"{checkpoint}.tmp", checkpoint)
+        return embeddings
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(run, batches))
+
+    if checkpoint_dir is not None:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    if not results:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(results)
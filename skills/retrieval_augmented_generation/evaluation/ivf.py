@@ -0,0 +1,146 @@
+"""Inverted-file (IVF) approximate nearest neighbour index for VectorDB.
+
+The corpus is partitioned by a spherical k-means coarse quantizer. A query is
+scored only against the rows of the `nprobe` partitions whose centroids are
+closest to it, so the cost per query is roughly nprobe / n_lists of brute force.
+"""
+
+import time
+
+import numpy as np
+
+
+def _nearest_centroids(vectors, centroids, n=1, block_size=4096):
+    # Indices of the n highest-scoring centroids for each vector, computed in blocks
+    # so the vectors x centroids score matrix never has more than block_size rows.
+    nearest = np.empty((len(vectors), n), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        scores = np.asarray(vectors[start : start + block_size]) @ centroids.T
+        if n >= centroids.shape[0]:
+            nearest[start : start + block_size] = np.argsort(-scores, axis=1)[:, :n]
+        else:
+            nearest[start : start + block_size] = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    return nearest
+
+
+class IVFIndex:
+    def __init__(self, centroids, list_offsets, list_ids):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @property
+    def count(self):
+        return len(self.list_ids)
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, iterations=20, sample_size=None, seed=0):
+        """Train the coarse quantizer on (a sample of) the unit-norm rows and bucket every row."""
+        count = len(embeddings)
+        if count == 0:
+            raise ValueError("Cannot build an IVF index over an empty vector database.")
+        if n_lists is None:
+            n_lists = int(np.sqrt(count))
+        n_lists = max(1, min(n_lists, count))
+        rng = np.random.default_rng(seed)
+
+        if sample_size is None:
+            sample_size = 256 * n_lists
+        sample_ids = (
+            np.arange(count)
+            if count <= sample_size
+            else np.sort(rng.choice(count, sample_size, replace=False))
+        )
+        sample = np.asarray(embeddings[sample_ids], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = _nearest_centroids(sample, centroids)[:, 0]
+            order = np.argsort(assignments, kind="stable")
+            sizes = np.bincount(assignments, minlength=n_lists)
+            filled = np.flatnonzero(sizes)
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(
+                sample[order], np.cumsum(sizes[filled]) - sizes[filled], axis=0
+            )
+            # Re-seed empty partitions with random sample rows so every list stays usable.
+            empty = np.flatnonzero(sizes == 0)
+            if len(empty):
+                sums[empty] = sample[rng.choice(len(sample), len(empty))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        assignments = _nearest_centroids(embeddings, centroids)[:, 0]
+        list_ids = np.argsort(assignments, kind="stable").astype(np.int64)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_ids)
+
+    def candidates(self, query_vectors, nprobe):
+        """Row ids to score for each query: the union of its nprobe closest lists."""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        probes = _nearest_centroids(query_vectors, self.centroids, n=nprobe)
+        return [
+            np.sort(
+                np.concatenate(
+                    [self.list_ids[self.list_offsets[p] : self.list_offsets[p + 1]] for p in row]
+                )
+            )
+            for row in probes
+        ]
+
+    def reordered(self, order):
+        """The same partitions with the rows renumbered: row order[i] becomes row i."""
+        new_rows = np.empty(self.count, dtype=np.int64)
+        new_rows[order] = np.arange(self.count)
+        return IVFIndex(self.centroids, self.list_offsets, new_rows[self.list_ids])
+
+    def save(self, file):
+        np.savez(
+            file, centroids=self.centroids, list_offsets=self.list_offsets, list_ids=self.list_ids
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["list_offsets"], data["list_ids"])
+
+
+def recall_report(embeddings, index, query_vectors, k=10, nprobe_values=(1, 2, 4, 8, 16, 32)):
+    """Recall@k of IVF search against exact search, with mean latency, for each nprobe."""
+    exact_start = time.perf_counter()
+    exact_scores = query_vectors @ np.asarray(embeddings).T
+    k = min(k, exact_scores.shape[1])
+    exact = [set(np.argpartition(-row, k - 1)[:k].tolist()) for row in exact_scores]
+    exact_ms = (time.perf_counter() - exact_start) * 1000 / max(len(query_vectors), 1)
+
+    report = []
+    for nprobe in nprobe_values:
+        if nprobe > index.n_lists:
+            break
+        start = time.perf_counter()
+        hits = 0
+        scanned = 0
+        for query_vector, rows, truth in zip(
+            query_vectors, index.candidates(query_vectors, nprobe), exact, strict=False
+        ):
+            scores = np.asarray(embeddings[rows]) @ query_vector
+            top = rows[np.argpartition(-scores, min(k, len(rows)) - 1)[:k]] if len(rows) else rows
+            hits += len(truth.intersection(top.tolist()))
+            scanned += len(rows)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        report.append(
+            {
+                "nprobe": nprobe,
+                "recall_at_k": hits / (k * max(len(query_vectors), 1)),
+                "mean_rows_scanned": scanned / max(len(query_vectors), 1),
+                "mean_latency_ms": elapsed_ms / max(len(query_vectors), 1),
+                "exact_mean_latency_ms": exact_ms,
+            }
+        )
+    return report
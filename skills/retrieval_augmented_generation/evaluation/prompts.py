@@ -1,29 +1,25 @@
-import json
 import os
 from typing import Callable, List, Dict, Any, Tuple, Set
-from vectordb import VectorDB, SummaryIndexedVectorDB
-from anthropic import Anthropic
+from stores import get_store
+from clients import get_client
+from rerank_cache import candidate_ids, open_rerank_cache
+from context import build_context
+from streaming import indices_complete, stream_until
 
-client = Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
+# Stores are loaded on the first call of the prompt that uses them (see stores.py)
 
-# Initialize the VectorDB
-db = VectorDB("anthropic_docs")
-# Load the Claude Documentation
-with open('../data/anthropic_docs.json', 'r') as f:
-    anthropic_docs = json.load(f)
-db.load_data(anthropic_docs)
+def _render_base(chunk):
+    return f"\n{chunk['text']}\n"
 
 def _retrieve_base(query, db):
     results = db.search(query, k=3)
-    context = ""
-    for result in results:
-        chunk = result['metadata']
-        context += f"\n{chunk['text']}\n"
+    # Pack the best chunks into the context token budget (see context.py)
+    results, context, _ = build_context(results, _render_base)
     return results, context
 
 def answer_query_base(context):
     input_query = context['vars']['query']
-    documents, document_context = _retrieve_base(input_query, db)
+    documents, document_context = _retrieve_base(input_query, get_store("anthropic_docs"))
     prompt = f"""
     You have been tasked with helping us to answer the following query: 
     <query>
@@ -39,19 +35,12 @@ def answer_query_base(context):
 
     return prompt
 
-# Initialize the VectorDB
-db_summary = SummaryIndexedVectorDB("anthropic_docs_summaries")
-# Load the Claude Documentation
-with open("../data/anthropic_summary_indexed_docs.json", 'r') as f:
-    anthropic_docs_summaries = json.load(f)
-db_summary.load_data(anthropic_docs_summaries)
+def _render_level_two(chunk):
+    return f"\n <document> \n {chunk['chunk_heading']}\n\nText\n {chunk['text']} \n\nSummary: \n {chunk['summary']} \n </document> \n" #show model all 3 items
 
 def retrieve_level_two(query):
-    results = db_summary.search(query, k=3)
-    context = ""
-    for result in results:
-        chunk = result['metadata']
-        context += f"\n <document> \n {chunk['chunk_heading']}\n\nText\n {chunk['text']} \n\nSummary: \n {chunk['summary']} \n </document> \n" #show model all 3 items
+    results = get_store("anthropic_docs_summaries").search(query, k=3)
+    results, context, _ = build_context(results, _render_level_two)
     return results, context
 
 def answer_query_level_two(context):
@@ -72,13 +61,6 @@ def answer_query_level_two(context):
 
     return prompt
 
-# Initialize the VectorDB
-db_rerank = SummaryIndexedVectorDB("anthropic_docs_rerank")
-# Load the Claude Documentation
-with open("../data/anthropic_summary_indexed_docs.json", 'r') as f:
-    anthropic_docs_summaries = json.load(f)
-db_rerank.load_data(anthropic_docs_summaries)
-
 def _rerank_results(query: str, results: List[Dict], k: int = 5) -> List[Dict]:
     # Prepare the summaries with their indices
     summaries = []
@@ -104,32 +86,45 @@ def _rerank_results(query: str, results: List[Dict], k: int = 5) -> List[Dict]:
     Output only the indices of {k} most relevant documents in order of relevance, separated by commas, enclosed in XML tags here:
     <relevant_indices>put the numbers of your indices here, seeparted by commas</relevant_indices>
     """
+    model = "claude-3-haiku-20240307"
+    rerank_cache = open_rerank_cache()
+    ids = candidate_ids(results)
     try:
-        response = client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=50,
-            messages=[{"role": "user", "content": prompt}, {"role": "assistant", "content": "<relevant_indices>"}],
-            temperature=0,
-            stop_sequences=["</relevant_indices>"]
-        )
+        # Reuse the stored answer when this exact rerank ran before (see rerank_cache.py)
+        relevant_indices = rerank_cache.get(model, query, ids, k)
+        if relevant_indices is None:
+            request = dict(
+                model=model,
+                max_tokens=50,
+                messages=[{"role": "user", "content": prompt}, {"role": "assistant", "content": "<relevant_indices>"}],
+                temperature=0,
+                stop_sequences=["</relevant_indices>"]
+            )
+            if os.getenv("RERANK_STREAM", "off") == "on":
+                # Stop generating once k indices are in (see streaming.py)
+                response_text = stream_until(get_client(), request, indices_complete(k))[len("<relevant_indices>"):].strip()
+            else:
+                response = get_client().messages.create(**request)
+                response_text = response.content[0].text.strip()
         
-        # Extract the indices from the response
-        response_text = response.content[0].text.strip()
-        indices_str = response_text
-        relevant_indices = []
-        for idx in indices_str.split(','):
-            try:
-                relevant_indices.append(int(idx.strip()))
-            except ValueError:
-                continue  # Skip invalid indices
-        print(indices_str)
-        print(relevant_indices)
-        # If we didn't get enough valid indices, fall back to the top k by original order
-        if len(relevant_indices) == 0:
-            relevant_indices = list(range(min(k, len(results))))
-        
-        # Ensure we don't have out-of-range indices
-        relevant_indices = [idx for idx in relevant_indices if idx < len(results)]
+            # Extract the indices from the response
+            indices_str = response_text
+            relevant_indices = []
+            for idx in indices_str.split(','):
+                try:
+                    relevant_indices.append(int(idx.strip()))
+                except ValueError:
+                    continue  # Skip invalid indices
+            print(indices_str)
+            print(relevant_indices)
+            # Ensure we don't have out-of-range indices
+            relevant_indices = [idx for idx in relevant_indices if idx < len(results)]
+            if relevant_indices:
+                rerank_cache.put(model, query, ids, k, relevant_indices)
+            else:
+                # If we didn't get any valid indices, fall back to the top k by original order.
+                # The fallback is not cached, so the next run asks the model again.
+                relevant_indices = list(range(min(k, len(results))))
         
         # Return the reranked results
         reranked_results = [results[idx] for idx in relevant_indices[:k]]
@@ -144,18 +139,18 @@ def _rerank_results(query: str, results: List[Dict], k: int = 5) -> List[Dict]:
         # Fall back to returning the top k results without reranking
         return results[:k]
 
+def _render_advanced(chunk):
+    return f"\n <document> \n {chunk['chunk_heading']}\n\n{chunk['text']} \n </document> \n"
+
 def _retrieve_advanced(query: str, k: int = 3, initial_k: int = 20) -> Tuple[List[Dict], str]:
     # Step 1: Get initial results
-    initial_results = db_rerank.search(query, k=initial_k)
+    initial_results = get_store("anthropic_docs_rerank").search(query, k=initial_k)
 
     # Step 2: Re-rank results
     reranked_results = _rerank_results(query, initial_results, k=k)
     
-    # Step 3: Generate new context string from re-ranked results
-    new_context = ""
-    for result in reranked_results:
-        chunk = result['metadata']
-        new_context += f"\n <document> \n {chunk['chunk_heading']}\n\n{chunk['text']} \n </document> \n"
+    # Step 3: Generate new context string from re-ranked results, within the token budget
+    reranked_results, new_context, _ = build_context(reranked_results, _render_advanced)
     
     return reranked_results, new_context
 
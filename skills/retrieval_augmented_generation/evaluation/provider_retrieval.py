@@ -1,19 +1,15 @@
-import json
+import asyncio
 import os
 from typing import Callable, List, Dict, Any, Tuple, Set
-from vectordb import VectorDB, SummaryIndexedVectorDB
-from anthropic import Anthropic
-
-# Initialize the VectorDB
-db = VectorDB("anthropic_docs")
-# Load the Claude Documentation
-with open('../data/anthropic_docs.json', 'r') as f:
-    anthropic_docs = json.load(f)
-db.load_data(anthropic_docs)
+from stores import get_store
+from clients import get_async_client, get_client, get_semaphore, on_client_loop
+from rerank_cache import candidate_ids, open_rerank_cache
+from streaming import astream_until, indices_complete, stream_until
 
+# Each provider loads only the store it searches, on its first call (see stores.py)
 def retrieve_base(query, options, context):
     input_query = context['vars']['query']
-    results = db.search(input_query, k=3)
+    results = get_store("anthropic_docs").search(input_query, k=3)
     outputs = []
     for result in results:
         outputs.append(result['metadata']['chunk_link'])
@@ -21,16 +17,9 @@ def retrieve_base(query, options, context):
     result = {"output": outputs}
     return result
 
-# Initialize the VectorDB
-db_summary = SummaryIndexedVectorDB("anthropic_docs_summaries")
-# Load the Claude Documentation
-with open("../data/anthropic_summary_indexed_docs.json", 'r') as f:
-    anthropic_docs_summaries = json.load(f)
-db_summary.load_data(anthropic_docs_summaries)
-
 def retrieve_level_two(query, options, context):
     input_query = context['vars']['query']
-    results = db_summary.search(input_query, k=3)
+    results = get_store("anthropic_docs_summaries").search(input_query, k=3)
     outputs = []
     for result in results:
         outputs.append(result['metadata']['chunk_link'])
@@ -38,7 +27,10 @@ def retrieve_level_two(query, options, context):
     result = {"output": outputs}
     return result
 
-def _rerank_results(query: str, results: List[Dict], k: int = 3) -> List[Dict]:
+RERANK_MODEL = "claude-3-5-sonnet-20241022"
+RERANK_PREFILL = "<relevant_indices>"
+
+def _rerank_request(query: str, results: List[Dict], k: int) -> Dict[str, Any]:
     # Prepare the summaries with their indices
     summaries = []
     print(len(results))
@@ -63,59 +55,97 @@ def _rerank_results(query: str, results: List[Dict], k: int = 3) -> List[Dict]:
     Output only the indices of {k} most relevant documents in order of relevance, separated by commas, enclosed in XML tags here:
     <relevant_indices>put the numbers of your indices here, seeparted by commas</relevant_indices>
     """
-    
-    client = Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
+    return dict(
+        model=RERANK_MODEL,
+        max_tokens=50,
+        messages=[{"role": "user", "content": prompt}, {"role": "assistant", "content": RERANK_PREFILL}],
+        temperature=0,
+        stop_sequences=["</relevant_indices>"]
+    )
+
+# With RERANK_STREAM=on the response is streamed and cut off after the k-th index (see streaming.py)
+def _rerank_text(request: Dict[str, Any], k: int) -> str:
+    if os.getenv("RERANK_STREAM", "off") == "on":
+        return stream_until(get_client(), request, indices_complete(k))[len(RERANK_PREFILL):]
+    return get_client().messages.create(**request).content[0].text
+
+# Runs on the process's client loop (see clients.py), under its shared semaphore
+async def _arerank_text(request: Dict[str, Any], k: int) -> str:
+    async with get_semaphore():
+        if os.getenv("RERANK_STREAM", "off") == "on":
+            return (await astream_until(get_async_client(), request, indices_complete(k)))[len(RERANK_PREFILL):]
+        return (await get_async_client().messages.create(**request)).content[0].text
+
+def _parse_relevant_indices(response_text: str, results: List[Dict], k: int) -> List[int]:
+    # Extract the indices from the response
+    indices_str = response_text.strip()
+    relevant_indices = []
+    for idx in indices_str.split(','):
+        try:
+            relevant_indices.append(int(idx.strip()))
+        except ValueError:
+            continue  # Skip invalid indices
+    print(indices_str)
+    print(relevant_indices)
+    # Ensure we don't have out-of-range indices
+    return [idx for idx in relevant_indices if idx < len(results)]
+
+def _fallback_indices(results: List[Dict], k: int) -> List[int]:
+    # If we didn't get any valid indices, fall back to the top k by original order.
+    # The fallback is not cached, so the next run asks the model again.
+    return list(range(min(k, len(results))))
+
+def _apply_rerank(results: List[Dict], relevant_indices: List[int], k: int) -> List[Dict]:
+    # Return the reranked results
+    reranked_results = [results[idx] for idx in relevant_indices[:k]]
+    # Assign descending relevance scores
+    for i, result in enumerate(reranked_results):
+        result['relevance_score'] = 100 - i  # Highest score is 100, decreasing by 1 for each rank
+    return reranked_results
+
+def _rerank_results(query: str, results: List[Dict], k: int = 3) -> List[Dict]:
+    request = _rerank_request(query, results, k)
+    rerank_cache = open_rerank_cache()
+    ids = candidate_ids(results)
     try:
-        response = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=50,
-            messages=[{"role": "user", "content": prompt}, {"role": "assistant", "content": "<relevant_indices>"}],
-            temperature=0,
-            stop_sequences=["</relevant_indices>"]
-        )
-        
-        # Extract the indices from the response
-        response_text = response.content[0].text.strip()
-        indices_str = response_text
-        relevant_indices = []
-        for idx in indices_str.split(','):
-            try:
-                relevant_indices.append(int(idx.strip()))
-            except ValueError:
-                continue  # Skip invalid indices
-        print(indices_str)
-        print(relevant_indices)
-        # If we didn't get enough valid indices, fall back to the top k by original order
-        if len(relevant_indices) == 0:
-            relevant_indices = list(range(min(k, len(results))))
-        
-        # Ensure we don't have out-of-range indices
-        relevant_indices = [idx for idx in relevant_indices if idx < len(results)]
-        
-        # Return the reranked results
-        reranked_results = [results[idx] for idx in relevant_indices[:k]]
-        # Assign descending relevance scores
-        for i, result in enumerate(reranked_results):
-            result['relevance_score'] = 100 - i  # Highest score is 100, decreasing by 1 for each rank
-        
-        return reranked_results
+        # Reuse the stored answer when this exact rerank ran before (see rerank_cache.py)
+        relevant_indices = rerank_cache.get(RERANK_MODEL, query, ids, k)
+        if relevant_indices is None:
+            relevant_indices = _parse_relevant_indices(_rerank_text(request, k), results, k)
+            if relevant_indices:
+                rerank_cache.put(RERANK_MODEL, query, ids, k, relevant_indices)
+            else:
+                relevant_indices = _fallback_indices(results, k)
+        return _apply_rerank(results, relevant_indices, k)
     
     except Exception as e:
         print(f"An error occurred during reranking: {str(e)}")
         # Fall back to returning the top k results without reranking
         return results[:k]
 
+async def _arerank_results(query: str, results: List[Dict], k: int = 3) -> List[Dict]:
+    request = _rerank_request(query, results, k)
+    rerank_cache = open_rerank_cache()
+    ids = candidate_ids(results)
+    try:
+        relevant_indices = rerank_cache.get(RERANK_MODEL, query, ids, k)
+        if relevant_indices is None:
+            response_text = await on_client_loop(_arerank_text(request, k))
+            relevant_indices = _parse_relevant_indices(response_text, results, k)
+            if relevant_indices:
+                rerank_cache.put(RERANK_MODEL, query, ids, k, relevant_indices)
+            else:
+                relevant_indices = _fallback_indices(results, k)
+        return _apply_rerank(results, relevant_indices, k)
+
+    except Exception as e:
+        print(f"An error occurred during reranking: {str(e)}")
+        return results[:k]
 
-# Initialize the VectorDB
-db_rerank = SummaryIndexedVectorDB("anthropic_docs_summaries_rerank")
-# Load the Claude Documentation
-with open("../data/anthropic_summary_indexed_docs.json", 'r') as f:
-    anthropic_docs_summaries = json.load(f)
-db_rerank.load_data(anthropic_docs_summaries)
 
 def retrieve_level_three(query, options, context):
     # Step 1: Get initial results from the summary db
-    initial_results = db_rerank.search(query, k=20)
+    initial_results = get_store("anthropic_docs_summaries_rerank").search(query, k=20)
 
     # Step 2: Re-rank results
     reranked_results = _rerank_results(query, initial_results, k=3)
@@ -131,4 +161,38 @@ def retrieve_level_three(query, options, context):
         outputs.append(result['metadata']['chunk_link'])
     print(outputs)
     result = {"output": outputs}
-    return result
\ No newline at end of file
+    return result
+
+
+# Async variants of the providers above, used by promptfooconfig_retrieval_async.yaml.
+# Embedding and rerank requests run on the process's client loop and share one
+# semaphore (EVAL_MAX_CONCURRENCY, see clients.py), however many event loops call
+# the providers, so at most that many are in flight.
+async def _alimited_search(store, query, k):
+    async with get_semaphore():
+        return await store.asearch(query, k=k)
+
+async def _asearch(store_name, query, k):
+    # The first call builds the store, which may embed the whole corpus: do that in a
+    # thread rather than on the caller's event loop.
+    store = await asyncio.to_thread(get_store, store_name)
+    return await on_client_loop(_alimited_search(store, query, k))
+
+async def aretrieve_base(query, options, context):
+    results = await _asearch("anthropic_docs", context['vars']['query'], k=3)
+    outputs = [result['metadata']['chunk_link'] for result in results]
+    print(outputs)
+    return {"output": outputs}
+
+async def aretrieve_level_two(query, options, context):
+    results = await _asearch("anthropic_docs_summaries", context['vars']['query'], k=3)
+    outputs = [result['metadata']['chunk_link'] for result in results]
+    print(outputs)
+    return {"output": outputs}
+
+async def aretrieve_level_three(query, options, context):
+    initial_results = await _asearch("anthropic_docs_summaries_rerank", query, k=20)
+    reranked_results = await _arerank_results(query, initial_results, k=3)
+    outputs = [result['metadata']['chunk_link'] for result in reranked_results]
+    print(outputs)
+    return {"output": outputs}
@@ -0,0 +1,243 @@
+"""Bounded, persistent cache of query embeddings.
+
+Entries are keyed by a hash of (embedding model, query text) and stored one row
+each in SQLite, so adding a query writes that row instead of re-serializing the
+whole cache. A bounded in-memory LRU in front of SQLite serves repeated queries
+without touching disk, and the SQLite table itself is pruned to `max_entries`
+least-recently-used rows.
+
+Writes are batched (write-behind): new entries are committed once `flush_every`
+are pending, once `flush_interval` seconds have passed since the last commit, or
+at interpreter exit.
+
+`get_many` is the single-flight entry point for concurrent callers: when several
+threads miss on the same query at once, one of them embeds it and the others wait
+for its result instead of sending duplicate embed requests. `aget` does the same
+for coroutines sharing an event loop.
+
+Because keys include the model, one file can be shared by any number of stores,
+including the RAG, classification and text_to_sql VectorDBs: point them all at the
+same path with the QUERY_CACHE_PATH environment variable. Each skill has its own
+copy of this module, so the file records SCHEMA_VERSION and a copy refuses to open a
+file written under another version.
+"""
+
+import asyncio
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Version of the key scheme (`_cache_key`), the table layout and the last_used pruning.
+# Bump it in every skill's copy when any of them changes.
+SCHEMA_VERSION = 1
+
+_open_caches = {}
+_open_caches_lock = threading.Lock()
+
+
+def _cache_key(model, query):
+    return hashlib.sha256(f"{model}\0{query}".encode()).hexdigest()
+
+
+class QueryEmbeddingCache:
+    def __init__(
+        self,
+        path,
+        max_entries=100_000,
+        max_memory_entries=10_000,
+        flush_every=32,
+        flush_interval=30.0,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_memory_entries = max_memory_entries
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._pending = {}
+        self._touched = set()
+        self._inflight = {}
+        self._async_inflight = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Several eval processes may share the file: wait for their writes instead of
+        # failing, and let readers proceed while one of them commits.
+        self._connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version == 0:
+            # A new file, or one written before the version was recorded (same layout).
+            self._connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        elif version != SCHEMA_VERSION:
+            self._connection.close()
+            raise ValueError(
+                f"{path} is a query cache of schema version {version}, expected {SCHEMA_VERSION}. "
+                "Point QUERY_CACHE_PATH at a separate file."
+            )
+        self._connection.commit()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()
+            return count + len(self._pending)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _remember(self, key, embedding):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model, query):
+        """The cached float32 embedding of `query` under `model`, or None."""
+        key = _cache_key(model, query)
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is None:
+                embedding = self._pending.get(key)
+            if embedding is None:
+                row = self._connection.execute(
+                    "SELECT embedding FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, embedding)
+            self._touched.add(key)
+            return embedding
+
+    def put(self, model, query, embedding):
+        key = _cache_key(model, query)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, embedding)
+            self._pending[key] = embedding
+
+    def get_many(self, model, queries, embed, batch_size=128):
+        """Embeddings of `queries` by query, embedding the uncached ones with `embed(batch)`."""
+        embeddings = {}
+        remaining = list(dict.fromkeys(queries))
+        while remaining:
+            owned, waiting = [], []
+            with self._lock:
+                for query in remaining:
+                    embedding = self.get(model, query)
+                    if embedding is not None:
+                        embeddings[query] = embedding
+                    elif (model, query) in self._inflight:
+                        waiting.append(query)
+                    else:
+                        self._inflight[(model, query)] = threading.Event()
+                        owned.append(query)
+            try:
+                for i in range(0, len(owned), batch_size):
+                    batch = owned[i : i + batch_size]
+                    for query, embedding in zip(batch, embed(batch), strict=False):
+                        embeddings[query] = np.asarray(embedding, dtype=np.float32)
+                        self.put(model, query, embeddings[query])
+            finally:
+                # Wake the waiters even if embedding failed; they retry the query themselves.
+                with self._lock:
+                    for query in owned:
+                        self._inflight.pop((model, query)).set()
+            for query in waiting:
+                event = self._inflight.get((model, query))
+                if event is not None:
+                    event.wait()
+            remaining = waiting
+        return embeddings
+
+    async def aget(self, model, query, aembed):
+        """Embedding of `query`, awaiting `aembed([query])` on a miss.
+
+        Coroutines of one event loop that miss on the same query await a single call.
+        """
+        embedding = self.get(model, query)
+        if embedding is not None:
+            return embedding
+        key = (asyncio.get_running_loop(), model, query)
+        task = self._async_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._aembed(model, query, aembed))
+            self._async_inflight[key] = task
+            task.add_done_callback(lambda _: self._async_inflight.pop(key, None))
+        # Shielded so that one cancelled caller does not cancel the embed the others await.
+        return await asyncio.shield(task)
+
+    async def _aembed(self, model, query, aembed):
+        embedding = np.asarray((await aembed([query]))[0], dtype=np.float32)
+        self.put(model, query, embedding)
+        return embedding
+
+    def maybe_flush(self):
+        with self._lock:
+            if self._pending and (
+                len(self._pending) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
+
+    def flush(self):
+        # Commit pending entries and recency updates in one transaction, then prune
+        # the table back to the max_entries most recently used rows.
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            now = time.time()
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO query_embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                    [(key, embedding.tobytes(), now) for key, embedding in self._pending.items()],
+                )
+                self._connection.executemany(
+                    "UPDATE query_embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in self._touched - self._pending.keys()],
+                )
+                if self._pending:
+                    self._connection.execute(
+                        "DELETE FROM query_embeddings WHERE key IN ("
+                        "SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    )
+            self._pending.clear()
+            self._touched.clear()
+            self._last_flush = time.monotonic()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "entries": len(self),
+        }
+
+
+def open_query_cache(path=None, default_path=None, **kwargs):
+    """The process-wide cache for `path` (or QUERY_CACHE_PATH, or `default_path`)."""
+    path = os.path.abspath(path or os.getenv("QUERY_CACHE_PATH") or default_path)
+    with _open_caches_lock:
+        if path not in _open_caches:
+            _open_caches[path] = QueryEmbeddingCache(path, **kwargs)
+        return _open_caches[path]
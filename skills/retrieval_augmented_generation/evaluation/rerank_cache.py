@@ -0,0 +1,128 @@
+"""Persistent cache of LLM rerank results.
+
+A rerank sends the query and every candidate chunk to Claude and gets back the
+indices of the most relevant ones. The answer only depends on the model, the
+query, the candidates in order and k, so it is stored in SQLite under a hash of
+exactly those inputs. Repeated eval sweeps then only pay for reranks whose inputs
+changed. A candidate is identified by its chunk_link and a hash of the heading and
+text shown to the model, so an edited chunk is reranked again.
+
+Environment variables:
+
+    RERANK_CACHE_PATH     cache file (default ./data/rerank_cache.sqlite)
+    RERANK_CACHE          "on" (default), "refresh" to ignore stored results and
+                          overwrite them, or "off" to neither read nor write
+    RERANK_CACHE_MAX_AGE  seconds after which a stored result is ignored
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = "./data/rerank_cache.sqlite"
+MODES = ("on", "refresh", "off")
+
+_open_caches = {}
+_open_caches_lock = threading.Lock()
+
+
+def candidate_ids(results):
+    """Identifiers of the candidates of a rerank, in order."""
+    ids = []
+    for result in results:
+        chunk = result["metadata"]
+        content = (
+            f"{chunk.get('chunk_heading', '')}\0{chunk.get('text', '')}\0{chunk.get('summary', '')}"
+        )
+        ids.append(
+            f"{chunk.get('chunk_link', '')}#{hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]}"
+        )
+    return ids
+
+
+def _cache_key(model, query, ids, k):
+    return hashlib.sha256(json.dumps([model, query, ids, k]).encode("utf-8")).hexdigest()
+
+
+class RerankCache:
+    def __init__(self, path, mode="on", max_age=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown rerank cache mode {mode!r}, expected one of {MODES}.")
+        self.path = path
+        self.mode = mode
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS reranks (key TEXT PRIMARY KEY, indices TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM reranks").fetchone()
+            return count
+
+    def get(self, model, query, ids, k):
+        """The stored indices for this rerank, or None."""
+        if self.mode != "on":
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT indices, created FROM reranks WHERE key = ?",
+                (_cache_key(model, query, ids, k),),
+            ).fetchone()
+            if row is None or (self.max_age is not None and time.time() - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, model, query, ids, k, indices):
+        if self.mode == "off":
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO reranks (key, indices, created) VALUES (?, ?, ?)",
+                (
+                    _cache_key(model, query, ids, k),
+                    json.dumps([int(i) for i in indices]),
+                    time.time(),
+                ),
+            )
+
+    def clear(self):
+        # Drop every stored rerank, e.g. after changing the rerank prompt.
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM reranks")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+            "mode": self.mode,
+        }
+
+
+def open_rerank_cache(path=None):
+    """The process-wide cache for `path` (or RERANK_CACHE_PATH, or DEFAULT_PATH)."""
+    path = os.path.abspath(path or os.getenv("RERANK_CACHE_PATH") or DEFAULT_PATH)
+    with _open_caches_lock:
+        if path not in _open_caches:
+            max_age = os.getenv("RERANK_CACHE_MAX_AGE")
+            _open_caches[path] = RerankCache(
+                path,
+                mode=os.getenv("RERANK_CACHE", "on"),
+                max_age=float(max_age) if max_age else None,
+            )
+        return _open_caches[path]
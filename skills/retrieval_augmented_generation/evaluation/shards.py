@@ -0,0 +1,97 @@
+"""Multi-process brute-force scoring for VectorDB.
+
+ShardPool splits the rows of a saved store's embedding matrix into `n_shards`
+contiguous slices and serves each slice from its own worker process, which
+memory-maps only that slice of embeddings.npy. A search sends the query matrix
+to every worker, each returns its local top-k, and the caller merges them. No
+process has to hold the whole matrix and scoring runs on `n_shards` cores.
+
+With one shard per core, limit BLAS to one thread per worker (for example
+OPENBLAS_NUM_THREADS=1 or OMP_NUM_THREADS=1) so the workers do not oversubscribe
+the machine.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Row offset and memory-mapped slice of the shard served by this worker process.
+_shard = None
+
+
+def _open_shard(path, start, stop):
+    global _shard
+    _shard = (start, np.load(path, mmap_mode="r")[start:stop])
+
+
+def _search_shard(query_matrix, k, similarity_threshold, rows, block_size=256):
+    # Top-k of every query within this shard, as (global row ids, similarities).
+    start, matrix = _shard
+    if rows is not None:
+        matrix = np.asarray(matrix[rows - start])
+    results = []
+    for block_start in range(0, len(query_matrix), block_size):
+        for similarities in query_matrix[block_start : block_start + block_size] @ matrix.T:
+            top = np.flatnonzero(similarities >= similarity_threshold)
+            if top.size > k:
+                top = top[np.argpartition(similarities[top], -k)[-k:]]
+            ids = top + start if rows is None else rows[top]
+            results.append((ids, similarities[top]))
+    return results
+
+
+class ShardPool:
+    def __init__(self, path, count, n_shards):
+        # Spawned rather than forked, so workers never inherit locks held by the
+        # parent's threads.
+        context = multiprocessing.get_context("spawn")
+        bounds = np.linspace(0, count, n_shards + 1).astype(np.int64)
+        self.shards = [
+            (
+                int(start),
+                int(stop),
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=context,
+                    initializer=_open_shard,
+                    initargs=(path, int(start), int(stop)),
+                ),
+            )
+            for start, stop in zip(bounds[:-1], bounds[1:], strict=False)
+            if stop > start
+        ]
+
+    @property
+    def n_shards(self):
+        return len(self.shards)
+
+    def search(self, query_matrix, k, similarity_threshold, rows=None):
+        """Per query, the row ids and similarities of every shard's top-k, concatenated."""
+        futures = []
+        for start, stop, executor in self.shards:
+            shard_rows = None
+            if rows is not None:
+                shard_rows = rows[(rows >= start) & (rows < stop)]
+                if not len(shard_rows):
+                    continue
+            futures.append(
+                executor.submit(_search_shard, query_matrix, k, similarity_threshold, shard_rows)
+            )
+        per_shard = [future.result() for future in futures]
+        merged = []
+        for i in range(len(query_matrix)):
+            ids = [results[i][0] for results in per_shard]
+            similarities = [results[i][1] for results in per_shard]
+            merged.append(
+                (
+                    np.concatenate(ids) if ids else np.empty(0, dtype=np.int64),
+                    np.concatenate(similarities) if similarities else np.empty(0, dtype=np.float32),
+                )
+            )
+        return merged
+
+    def close(self):
+        for _, _, executor in self.shards:
+            executor.shutdown(wait=True)
+        self.shards = []
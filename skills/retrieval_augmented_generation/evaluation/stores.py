@@ -0,0 +1,82 @@
+"""Lazily loaded vector stores shared by the promptfoo providers.
+
+promptfoo imports provider_retrieval.py and prompts.py in every worker, even when
+only one of their providers runs. Instead of building every store at import time,
+the providers ask for a store by name with `get_store`. Each store is built on its
+first use and then reused for the life of the process, and each corpus JSON file
+is parsed at most once however many stores are built from it.
+
+Stores built from the same corpus contents, with the same VectorDB class (and so
+the same text formatter) and embedding model, hold identical embeddings, so they
+are one store: one embedding run, one matrix on disk under ./data/<corpus>/ and one
+copy in memory, whatever provider names refer to it.
+"""
+
+import hashlib
+import json
+import threading
+
+from embeddings import get_embedder
+from vectordb import SummaryIndexedVectorDB, VectorDB
+
+CORPORA = {
+    "anthropic_docs": "../data/anthropic_docs.json",
+    "anthropic_summary_indexed_docs": "../data/anthropic_summary_indexed_docs.json",
+}
+
+# Store name -> (VectorDB class, corpus it is built from). The three summary-indexed
+# names resolve to the same store.
+STORES = {
+    "anthropic_docs": (VectorDB, "anthropic_docs"),
+    "anthropic_docs_summaries": (SummaryIndexedVectorDB, "anthropic_summary_indexed_docs"),
+    "anthropic_docs_summaries_rerank": (SummaryIndexedVectorDB, "anthropic_summary_indexed_docs"),
+    "anthropic_docs_rerank": (SummaryIndexedVectorDB, "anthropic_summary_indexed_docs"),
+}
+
+_corpora = {}
+_stores = {}
+_stores_by_key = {}
+_embedder = None
+_lock = threading.RLock()
+
+
+def _load_corpus(name):
+    # (sha256 of the file, parsed documents), read from disk once per process
+    with _lock:
+        if name not in _corpora:
+            with open(CORPORA[name], "rb") as f:
+                raw = f.read()
+            _corpora[name] = (hashlib.sha256(raw).hexdigest(), json.loads(raw))
+        return _corpora[name]
+
+
+def load_corpus(name):
+    """The parsed documents of a corpus in CORPORA, read from disk once per process."""
+    return _load_corpus(name)[1]
+
+
+def _get_embedder():
+    global _embedder
+    with _lock:
+        if _embedder is None:
+            _embedder = get_embedder()
+        return _embedder
+
+
+def get_store(name):
+    """The named store from STORES, built and synced with its corpus on first use."""
+    store = _stores.get(name)
+    if store is not None:
+        return store
+    with _lock:
+        if name not in _stores:
+            vectordb_class, corpus = STORES[name]
+            embedder = _get_embedder()
+            corpus_hash, documents = _load_corpus(corpus)
+            key = (corpus_hash, vectordb_class, embedder.model)
+            if key not in _stores_by_key:
+                store = vectordb_class(corpus, embedder=embedder)
+                store.load_data(documents)
+                _stores_by_key[key] = store
+            _stores[name] = _stores_by_key[key]
+        return _stores[name]
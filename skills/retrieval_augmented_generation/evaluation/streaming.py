@@ -0,0 +1,59 @@
+"""Streamed Messages requests that stop as soon as the fields we need are complete.
+
+Graders and rerankers answer in XML tags, but a blocking request waits for the
+whole completion before any tag is read. `stream_until` streams the response
+instead, feeds the text to a `done(text)` predicate as it arrives, and closes the
+stream once the predicate holds. Closing the stream ends generation, so tokens
+the caller would have discarded are never produced.
+
+The text passed to `done` and returned starts with the request's assistant
+prefill, if any, so tags opened by the prefill are seen closed by the stream.
+"""
+
+import re
+
+
+def _prefill(request):
+    last = request["messages"][-1]
+    return (
+        last["content"] if last["role"] == "assistant" and isinstance(last["content"], str) else ""
+    )
+
+
+def fields_closed(*fields):
+    """Predicate that holds once every `<field>...</field>` in `fields` is closed."""
+    closing_tags = [f"</{field}>" for field in fields]
+    return lambda text: all(tag in text for tag in closing_tags)
+
+
+def indices_complete(k):
+    """Predicate that holds once k integers have been streamed, each followed by a non-digit.
+
+    The k-th integer only needs its terminator, whatever it is (a comma, a space, a
+    newline or a closing tag), so the stream stops without waiting for a trailing comma
+    the model never writes.
+    """
+    pattern = re.compile(r"\d+(?=\D)")
+    return lambda text: len(pattern.findall(text)) >= k
+
+
+def stream_until(client, request, done):
+    """The response text (prefill included) when `done(text)` first holds, or at the end of the stream."""
+    text = _prefill(request)
+    with client.messages.stream(**request) as stream:
+        for chunk in stream.text_stream:
+            text += chunk
+            if done(text):
+                break
+    return text
+
+
+async def astream_until(client, request, done):
+    """Coroutine version of `stream_until` for an AsyncAnthropic client."""
+    text = _prefill(request)
+    async with client.messages.stream(**request) as stream:
+        async for chunk in stream.text_stream:
+            text += chunk
+            if done(text):
+                break
+    return text
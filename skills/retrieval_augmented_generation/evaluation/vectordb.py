@@ -1,172 +1,644 @@
+import asyncio
 import os
 import pickle
 import json
+import hashlib
+import threading
+from types import SimpleNamespace
 import numpy as np
-import voyageai
+import quantization
+from bm25 import BM25Index, reciprocal_rank_fusion, weighted_fusion
+from embeddings import DEFAULT_MODEL, get_embedder
+from ingest import RateLimiter, embed_batches
+from ivf import IVFIndex, recall_report
+from query_cache import open_query_cache
+from shards import ShardPool
+
+# On-disk layout of a store directory. Bump when the layout changes.
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+QUERY_CACHE_FILE = "query_cache.sqlite"
+LEGACY_QUERY_CACHE_FILE = "query_cache.json"
+IVF_INDEX_FILE = "ivf_index.npz"
+BM25_INDEX_FILE = "bm25_index.npz"
+QUANTIZER_FILE = "quantizer.npz"
+CONTENT_HASHES_FILE = "content_hashes.json"
+
+# `asearch` scores stores (or filtered subsets) of up to this many rows on the event
+# loop, where a thread hand-off would cost more than the scoring itself.
+INLINE_SCORING_ROWS = 10_000
+
+
+def _to_matrix(embeddings):
+    # One C-contiguous float32 block with unit-norm rows, so search is a single
+    # matrix-vector product and the dot product is the cosine similarity.
+    matrix = np.array(embeddings, dtype=np.float32, order="C")
+    if matrix.size == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def _top_k(similarities, k, similarity_threshold):
+    # Partial selection of the k best rows above the threshold instead of a full sort.
+    candidates = np.flatnonzero(similarities >= similarity_threshold)
+    if k <= 0 or candidates.size == 0:
+        return candidates[:0]
+    if candidates.size > k:
+        candidates = candidates[np.argpartition(similarities[candidates], -k)[-k:]]
+    return candidates[np.argsort(-similarities[candidates], kind="stable")]
+
+
+def _top_rows(similarities, k, similarity_threshold, rows=None):
+    # `rows` maps positions in `similarities` back to rows of the store when only
+    # a subset of the matrix was scored.
+    top = _top_k(similarities, k, similarity_threshold)
+    return (top if rows is None else rows[top]), similarities[top]
+
+
+def _content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path, write):
+    # Write to a sibling temp file and rename it over the target, so readers that
+    # have the old file memory-mapped or open never observe a partial write.
+    # The temp name is unique per process and thread, so concurrent writers never
+    # interleave in one temp file; the last rename wins with a complete file.
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        write(file)
+    os.replace(tmp_path, path)
+
+
+def _write_json(path, obj):
+    _write_atomic(path, lambda file: file.write(json.dumps(obj, separators=(",", ":")).encode("utf-8")))
+
 
 class VectorDB:
-    def __init__(self, name, api_key=None):
-        if api_key is None:
-            api_key = os.getenv("VOYAGE_API_KEY")
-        self.client = voyageai.Client(api_key=api_key)
+    # Directory name of the store under ./data/<name>/
+    store_name = "vector_db"
+    # Metadata fields indexed for `where` filters at load time
+    filter_fields = ("chunk_link", "chunk_heading")
+
+    def __init__(
+        self,
+        name,
+        api_key=None,
+        flush_every=32,
+        flush_interval=30.0,
+        index="exact",
+        nprobe=8,
+        n_lists=None,
+        storage="float32",
+        rescore_factor=4,
+        max_workers=4,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        embedder=None,
+        query_cache_path=None,
+        max_cached_queries=100_000,
+        shards=None,
+    ):
+        # Any object with a `model` name and an `embed(texts)` method; by default the
+        # provider named by EMBEDDING_PROVIDER (Voyage unless set, see embeddings.py).
+        self.embedder = embedder if embedder is not None else get_embedder(api_key=api_key)
         self.name = name
-        self.embeddings = []
+        # Searches are read-only and may run from many threads at once. Anything that
+        # replaces the matrix, metadata or indexes holds this lock, and a search takes
+        # a consistent snapshot of them under it before scoring without the lock.
+        self._lock = threading.RLock()
+        self.embeddings = _to_matrix([])
         self.metadata = []
-        self.query_cache = {}
-        self.db_path = f"./data/{name}/vector_db.pkl"
+        # Hash of the embedded text of each row, used to tell which rows a new
+        # version of the data adds, changes or removes.
+        self.content_hashes = []
+        self.metadata_index = {}
+        self._set_store_path(f"./data/{name}/{self.store_name}")
+        # Bounded LRU of query embeddings in its own SQLite file, keyed by model and
+        # query, so it can be shared between stores (see query_cache.py). New entries
+        # are written behind: once `flush_every` are pending, once `flush_interval`
+        # seconds have passed since the last write, or at interpreter exit.
+        self.query_cache = open_query_cache(
+            query_cache_path,
+            default_path=self._path(QUERY_CACHE_FILE),
+            max_entries=max_cached_queries,
+            flush_every=flush_every,
+            flush_interval=flush_interval,
+        )
+        # index="ivf" scores each query against only the `nprobe` closest of `n_lists`
+        # k-means partitions instead of the whole matrix. Exact search is the default.
+        if index not in ("exact", "ivf"):
+            raise ValueError(f"Unknown index type {index!r}, expected 'exact' or 'ivf'.")
+        self.index = index
+        self.nprobe = nprobe
+        self.n_lists = n_lists
+        self.ivf_index = None
+        # BM25 postings over the same formatted texts, for lexical and hybrid search.
+        self.bm25_index = None
+        # storage="int8" or "pq" keeps compact codes in memory, ranks rows by their
+        # approximate similarity, and re-scores the best k * rescore_factor rows
+        # exactly against the memory-mapped float32 matrix.
+        if storage != "float32" and storage not in quantization.QUANTIZERS:
+            raise ValueError(f"Unknown storage mode {storage!r}, expected 'float32', 'int8' or 'pq'.")
+        self.storage = storage
+        self.rescore_factor = rescore_factor
+        self.quantizer = None
+        # Corpus ingestion embeds up to `max_workers` batches at once within the
+        # given request/token budget and checkpoints finished batches.
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # shards=N (or VECTORDB_SHARDS=N) splits exact scoring across N worker
+        # processes, each memory-mapping one slice of the saved matrix (see shards.py).
+        self.shards = int(os.getenv("VECTORDB_SHARDS", "1")) if shards is None else shards
+        self.shard_pool = None
+
+    def _set_store_path(self, path):
+        # Stores embedded with a non-default model live next to the default one
+        # instead of overwriting it.
+        if self.embedder.model != DEFAULT_MODEL:
+            path = f"{path}-{self.embedder.model}"
+        self.db_path = path
+        self.legacy_db_path = f"{path}.pkl"
+
+    def _format_text(self, item):
+        return f"Heading: {item['chunk_heading']}\n\n Chunk Text:{item['text']}"
 
     def load_data(self, data):
-        if self.embeddings and self.metadata:
-            print("Vector database is already loaded. Skipping data loading.")
-            return
-        if os.path.exists(self.db_path):
-            print("Loading vector database from disk.")
-            self.load_db()
+        with self._lock:
+            if not len(self.embeddings) and self._store_exists():
+                print("Loading vector database from disk.")
+                self.load_db()
+            self._sync(data)
+
+    def upsert(self, items):
+        # Add new items and replace the metadata of items whose text is already stored.
+        with self._lock:
+            updates = {_content_hash(self._format_text(item)): item for item in items}
+            data = [updates.pop(content_hash, item) for item, content_hash in zip(self.metadata, self.content_hashes, strict=True)]
+            self._sync(data + list(updates.values()))
+
+    def delete(self, items):
+        with self._lock:
+            removed = {_content_hash(self._format_text(item)) for item in items}
+            self._sync(
+                [item for item, content_hash in zip(self.metadata, self.content_hashes, strict=True) if content_hash not in removed]
+            )
+
+    def _sync(self, data):
+        # Make the store hold exactly `data`, in order, embedding only the texts
+        # whose content hash is not stored yet and dropping rows that are gone.
+        texts = [self._format_text(item) for item in data]
+        hashes = [_content_hash(text) for text in texts]
+        if len(self.embeddings) and sorted(hashes) == sorted(self.content_hashes):
+            # Same texts, possibly in another order or with different metadata (e.g. a
+            # moved chunk_link): no re-embedding, and the derived indexes are kept.
+            reordered = hashes != self.content_hashes
+            if reordered:
+                print("Vector database rows were reordered. Saving the new order.")
+                self._reorder(hashes)
+            if reordered or data != self.metadata:
+                self.metadata = data
+                self._build_metadata_index()
+                self.save_db()
+            if reordered:
+                self._start_shards()
+            print("Vector database is already loaded and up to date. Skipping data loading.")
             return
-        
-        texts = [f"Heading: {item['chunk_heading']}\n\n Chunk Text:{item['text']}" for item in data]
-        self._embed_and_store(texts, data)
+
+        stored_rows = {content_hash: row for row, content_hash in enumerate(self.content_hashes)}
+        missing = {content_hash: text for content_hash, text in zip(hashes, texts, strict=True) if content_hash not in stored_rows}
+        new_embeddings = self._embed_texts(list(missing.values()))
+        new_rows = {content_hash: row for row, content_hash in enumerate(missing)}
+
+        dim = new_embeddings.shape[1] if len(new_embeddings) else self.embeddings.shape[1] if len(self.embeddings) else 0
+        embeddings = np.empty((len(data), dim), dtype=np.float32)
+        kept = [position for position, content_hash in enumerate(hashes) if content_hash in stored_rows]
+        added = [position for position, content_hash in enumerate(hashes) if content_hash in new_rows]
+        if kept:
+            embeddings[kept] = self.embeddings[[stored_rows[hashes[position]] for position in kept]]
+        if added:
+            embeddings[added] = new_embeddings[[new_rows[hashes[position]] for position in added]]
+        removed = len(set(self.content_hashes) - set(hashes))
+        if self.content_hashes:
+            print(f"Vector database is stale: embedding {len(missing)} new or changed chunks, dropping {removed}.")
+
+        self.embeddings = embeddings
+        self.metadata = data
+        self.content_hashes = hashes
+        self._build_indexes()
         self.save_db()
+        self._start_shards()
         print("Vector database loaded and saved.")
 
-    def _embed_and_store(self, texts, data):
-        batch_size = 128
-        result = [
-            self.client.embed(
-                texts[i : i + batch_size],
-                model="voyage-2"
-            ).embeddings
-            for i in range(0, len(texts), batch_size)
+    def _reorder(self, hashes):
+        # Move the stored rows, and every index entry pointing at them, into the order
+        # of `hashes`, which holds the same content hashes as the store.
+        rows = {}
+        for row, content_hash in enumerate(self.content_hashes):
+            rows.setdefault(content_hash, []).append(row)
+        order = np.array([rows[content_hash].pop() for content_hash in hashes], dtype=np.int64)
+        self.embeddings = np.ascontiguousarray(self.embeddings[order])
+        self.metadata = [self.metadata[row] for row in order]
+        self.content_hashes = hashes
+        if self.bm25_index is not None:
+            self.bm25_index = self.bm25_index.reordered(order)
+        if self.ivf_index is not None:
+            self.ivf_index = self.ivf_index.reordered(order)
+        if self.quantizer is not None:
+            self.quantizer = self.quantizer.reordered(order)
+
+    def _embed_texts(self, texts):
+        # Finished batches are checkpointed next to the store, so an interrupted
+        # ingest resumes with the batches that were still missing.
+        embeddings = embed_batches(
+            self.embedder.embed,
+            texts,
+            max_workers=self.max_workers,
+            rate_limiter=self.rate_limiter,
+            checkpoint_dir=f"{self.db_path}.ingest",
+        )
+        return _to_matrix(embeddings)
+
+    def _embed_queries(self, queries):
+        # Embed the queries that are not cached yet in as few requests as possible
+        # (a query another thread is already embedding is waited for, not re-sent),
+        # then return every query as one normalized row of a matrix.
+        embeddings = self.query_cache.get_many(self.embedder.model, queries, self.embedder.embed)
+        return _to_matrix([embeddings[query] for query in queries])
+
+    def search(self, query, k=3, similarity_threshold=0.75, where=None):
+        return self.search_many([query], k=k, similarity_threshold=similarity_threshold, where=where)[0]
+
+    def search_many(self, queries, k=3, similarity_threshold=0.75, where=None):
+        # `where` restricts the search to rows whose metadata matches every field,
+        # e.g. {"chunk_heading": "Get started"}; a list of values matches any of them.
+        query_matrix = self._embed_queries(queries)
+        snapshot = self._snapshot(where)
+        hits = self._search_rows(snapshot, query_matrix, k, similarity_threshold)
+        self._maybe_flush()
+        return [self._results(snapshot, rows, similarities) for rows, similarities in hits]
+
+    async def asearch(self, query, k=3, similarity_threshold=0.75, where=None):
+        # Coroutine version of `search` for async providers: the query embedding is
+        # awaited (shared by concurrent coroutines asking for the same query). Scoring
+        # more than INLINE_SCORING_ROWS rows, or waiting on shard workers, runs in a
+        # thread, so the requests in flight on the event loop are not held up by it.
+        embedding = await self.query_cache.aget(self.embedder.model, query, self._aembed)
+        query_matrix = _to_matrix([embedding])
+        snapshot = self._snapshot(where)
+        scored_rows = len(snapshot.embeddings) if snapshot.rows is None else len(snapshot.rows)
+        if snapshot.shard_pool is not None or scored_rows > INLINE_SCORING_ROWS:
+            hits = await asyncio.to_thread(self._search_rows, snapshot, query_matrix, k, similarity_threshold)
+        else:
+            hits = self._search_rows(snapshot, query_matrix, k, similarity_threshold)
+        self._maybe_flush()
+        rows, similarities = hits[0]
+        return self._results(snapshot, rows, similarities)
+
+    async def _aembed(self, texts):
+        aembed = getattr(self.embedder, "aembed", None)
+        if aembed is None:
+            return await asyncio.to_thread(self.embedder.embed, texts)
+        return await aembed(texts)
+
+    def _results(self, snapshot, rows, similarities):
+        return [
+            {"metadata": snapshot.metadata[row], "similarity": float(similarity)}
+            for row, similarity in zip(rows, similarities, strict=True)
         ]
-        self.embeddings = [embedding for batch in result for embedding in batch]
-        self.metadata = data
 
-    def search(self, query, k=3, similarity_threshold=0.75):
-        if query in self.query_cache:
-            query_embedding = self.query_cache[query]
+    def _snapshot(self, where=None):
+        # Everything a search reads, taken together under the lock. Writers replace
+        # these objects rather than mutate them, so the snapshot stays consistent
+        # while it is scored without the lock.
+        with self._lock:
+            return SimpleNamespace(
+                embeddings=self.embeddings,
+                metadata=self.metadata,
+                ivf_index=self.ivf_index,
+                quantizer=self.quantizer,
+                shard_pool=self.shard_pool,
+                bm25_index=self.bm25_index,
+                rows=None if where is None else self._filter_rows(where),
+            )
+
+    def _search_rows(self, snapshot, query_matrix, k, similarity_threshold):
+        # For every query, the row ids and similarities of its top k rows, best first.
+        # Thresholds are on the voyage-2 scale (see embeddings.py).
+        similarity_threshold *= getattr(self.embedder, "similarity_scale", 1.0)
+        embeddings, rows = snapshot.embeddings, snapshot.rows
+        ivf_index, quantizer, shard_pool = snapshot.ivf_index, snapshot.quantizer, snapshot.shard_pool
+        if not len(embeddings):
+            raise ValueError("No data loaded in the vector database.")
+
+        hits = []
+        if quantizer is not None or (ivf_index is not None and rows is None):
+            if rows is not None:
+                candidates = [rows] * len(query_matrix)
+            elif ivf_index is not None:
+                candidates = ivf_index.candidates(query_matrix, self.nprobe)
+            else:
+                candidates = [None] * len(query_matrix)
+            for query_vector, candidate_rows in zip(query_matrix, candidates, strict=True):
+                if quantizer is not None:
+                    candidate_rows = quantization.shortlist(
+                        quantizer, query_vector, k * self.rescore_factor, candidate_rows
+                    )
+                similarities = np.asarray(embeddings[candidate_rows]) @ query_vector
+                hits.append(_top_rows(similarities, k, similarity_threshold, candidate_rows))
+        elif shard_pool is not None:
+            # Every shard returns its own top-k; the best k of those are the global top-k.
+            for shard_rows, similarities in shard_pool.search(query_matrix, k, similarity_threshold, rows):
+                hits.append(_top_rows(similarities, k, similarity_threshold, shard_rows))
         else:
-            query_embedding = self.client.embed([query], model="voyage-2").embeddings[0]
-            self.query_cache[query] = query_embedding
+            # Exact scoring of the whole matrix, or with a filter of only the matching
+            # rows (filtered queries skip the IVF probe; the filter is already narrower).
+            matrix = embeddings if rows is None else np.asarray(embeddings[rows])
+            # Score blocks of queries with one matrix-matrix product each, which bounds
+            # the similarity matrix to block_size rows for large query sets.
+            block_size = 256
+            for start in range(0, len(query_matrix), block_size):
+                for similarities in query_matrix[start : start + block_size] @ matrix.T:
+                    hits.append(_top_rows(similarities, k, similarity_threshold, rows))
+        return hits
 
-        if not self.embeddings:
+    def lexical_search(self, query, k=3, where=None):
+        # BM25 keyword search; only rows sharing at least one term with the query match.
+        snapshot = self._snapshot(where)
+        if snapshot.bm25_index is None:
             raise ValueError("No data loaded in the vector database.")
+        top_rows, scores = snapshot.bm25_index.top_k(query, k, snapshot.rows)
+        return [
+            {"metadata": snapshot.metadata[row], "score": float(score)}
+            for row, score in zip(top_rows, scores, strict=True)
+        ]
 
-        similarities = np.dot(self.embeddings, query_embedding)
-        top_indices = np.argsort(similarities)[::-1]
-        top_examples = []
-        
-        for idx in top_indices:
-            if similarities[idx] >= similarity_threshold:
-                example = {
-                    "metadata": self.metadata[idx],
-                    "similarity": similarities[idx],
-                }
-                top_examples.append(example)
-                
-                if len(top_examples) >= k:
-                    break
-        self.save_db()
-        return top_examples
+    def hybrid_search(self, query, k=3, where=None, method="rrf", alpha=0.5, candidates=50, rrf_k=60):
+        # Dense and BM25 retrieval fused into one ranking. Each side contributes its
+        # top `candidates` rows; method="rrf" sums 1 / (rrf_k + rank) over both lists,
+        # method="weighted" sums their min-max normalized scores weighted alpha (dense)
+        # and 1 - alpha (BM25).
+        if method not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion method {method!r}, expected 'rrf' or 'weighted'.")
+        query_matrix = self._embed_queries([query])
+        snapshot = self._snapshot(where)
+        [(dense_rows, similarities)] = self._search_rows(snapshot, query_matrix, candidates, -1.0)
+        self._maybe_flush()
+        lexical_rows, lexical_scores = snapshot.bm25_index.top_k(query, candidates, snapshot.rows)
 
-    def save_db(self):
-        data = {
-            "embeddings": self.embeddings,
-            "metadata": self.metadata,
-            "query_cache": json.dumps(self.query_cache),
-        }
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        with open(self.db_path, "wb") as file:
-            pickle.dump(data, file)
+        if method == "rrf":
+            fused = reciprocal_rank_fusion([dense_rows, lexical_rows], rrf_k)
+        else:
+            fused = weighted_fusion([(dense_rows, similarities), (lexical_rows, lexical_scores)], [alpha, 1 - alpha])
+        dense = dict(zip(dense_rows.tolist(), similarities.tolist(), strict=True))
+        lexical = dict(zip(lexical_rows.tolist(), lexical_scores.tolist(), strict=True))
+        best = sorted(fused, key=lambda row: (-fused[row], row))[:k]
+        return [
+            {
+                "metadata": snapshot.metadata[row],
+                "score": fused[row],
+                "similarity": dense.get(row),
+                "bm25_score": lexical.get(row),
+            }
+            for row in best
+        ]
 
-    def load_db(self):
-        if not os.path.exists(self.db_path):
-            raise ValueError("Vector database file not found. Use load_data to create a new database.")
-        with open(self.db_path, "rb") as file:
-            data = pickle.load(file)
-        self.embeddings = data["embeddings"]
-        self.metadata = data["metadata"]
-        self.query_cache = json.loads(data["query_cache"])
+    def _build_metadata_index(self):
+        self.metadata_index = {}
+        for field in self.filter_fields:
+            self._postings(field)
 
+    def _postings(self, field):
+        # Inverted index from each value of a metadata field to the sorted ids of the
+        # rows holding it. Fields outside `filter_fields` are indexed on first use.
+        if field not in self.metadata_index:
+            postings = {}
+            for row, item in enumerate(self.metadata):
+                value = item.get(field)
+                if isinstance(value, str | int | float | bool):
+                    postings.setdefault(value, []).append(row)
+            self.metadata_index[field] = {value: np.array(ids, dtype=np.int64) for value, ids in postings.items()}
+        return self.metadata_index[field]
 
-class SummaryIndexedVectorDB:
-    def __init__(self, name, api_key=None):
-        if api_key is None:
-            api_key = os.getenv("VOYAGE_API_KEY")
-        self.client = voyageai.Client(api_key=api_key)
-        self.name = name
-        self.embeddings = []
-        self.metadata = []
-        self.query_cache = {}
-        self.db_path = f"./data/{name}/summary_indexed_vector_db.pkl"
+    def _filter_rows(self, where):
+        rows = None
+        for field, wanted in where.items():
+            postings = self._postings(field)
+            values = wanted if isinstance(wanted, list | tuple | set | frozenset) else [wanted]
+            matches = [postings[value] for value in values if value in postings]
+            matched = np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype=np.int64)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return rows
 
-    def load_data(self, data):
-        if self.embeddings and self.metadata:
-            print("Vector database is already loaded. Skipping data loading.")
-            return
-        if os.path.exists(self.db_path):
-            print("Loading vector database from disk.")
-            self.load_db()
-            return
-        
-        texts = [f"{item['chunk_heading']}\n\n{item['text']}\n\n{item['summary']}" for item in data]  # Embed Chunk Heading + Text + Summary Together
-        self._embed_and_store(texts, data)
-        self.save_db()
-        print("Vector database loaded and saved.")
+    def _start_shards(self):
+        # Workers map the saved matrix, so (re)start them whenever it is written or loaded.
+        if self.shard_pool is not None:
+            self.shard_pool.close()
+            self.shard_pool = None
+        if self.shards > 1 and len(self.embeddings):
+            self.shard_pool = ShardPool(self._path(EMBEDDINGS_FILE), len(self.embeddings), self.shards)
 
-    def _embed_and_store(self, texts, data):
-        batch_size = 128
-        result = [
-            self.client.embed(
-                texts[i : i + batch_size],
-                model="voyage-2"
-            ).embeddings
-            for i in range(0, len(texts), batch_size)
-        ]
-        self.embeddings = [embedding for batch in result for embedding in batch]
-        self.metadata = data
+    def close(self):
+        # Stop the shard workers and write pending query embeddings.
+        with self._lock:
+            if self.shard_pool is not None:
+                self.shard_pool.close()
+                self.shard_pool = None
+        self.flush()
 
-    def search(self, query, k=5, similarity_threshold=0.75):
-        if query in self.query_cache:
-            query_embedding = self.query_cache[query]
-        else:
-            query_embedding = self.client.embed([query], model="voyage-2").embeddings[0]
-            self.query_cache[query] = query_embedding
+    def _build_indexes(self):
+        self._build_metadata_index()
+        self.build_bm25_index()
+        if self.index == "ivf":
+            self.build_ivf_index()
+        if self.storage != "float32":
+            self.build_quantizer()
 
-        if not self.embeddings:
-            raise ValueError("No data loaded in the vector database.")
+    def build_bm25_index(self, **kwargs):
+        with self._lock:
+            self.bm25_index = BM25Index.build([self._format_text(item) for item in self.metadata], **kwargs)
+            return self.bm25_index
 
-        similarities = np.dot(self.embeddings, query_embedding)
-        top_indices = np.argsort(similarities)[::-1]
-        top_examples = []
-        
-        for idx in top_indices:
-            if similarities[idx] >= similarity_threshold:
-                example = {
-                    "metadata": self.metadata[idx],
-                    "similarity": similarities[idx],
-                }
-                top_examples.append(example)
-                
-                if len(top_examples) >= k:
-                    break
-        self.save_db()
-        return top_examples
+    def build_quantizer(self, **kwargs):
+        with self._lock:
+            self.quantizer = quantization.QUANTIZERS[self.storage].build(self.embeddings, **kwargs)
+            return self.quantizer
+
+    def quantization_report(self, queries, k=10):
+        # Memory footprint and recall@k of the quantized codes relative to exact search.
+        if self.quantizer is None:
+            self.build_quantizer()
+        query_matrix = self._embed_queries(queries)
+        self._maybe_flush()
+        return quantization.quantization_report(
+            self.embeddings, self.quantizer, query_matrix, k=k, rescore_factor=self.rescore_factor
+        )
+
+    def build_ivf_index(self, n_lists=None):
+        with self._lock:
+            self.ivf_index = IVFIndex.build(self.embeddings, n_lists=n_lists or self.n_lists)
+            return self.ivf_index
+
+    def ivf_recall_report(self, queries, k=10, nprobe_values=(1, 2, 4, 8, 16, 32)):
+        # Recall@k and latency of the IVF index relative to exact search over the same queries.
+        if self.ivf_index is None:
+            self.build_ivf_index()
+        query_matrix = self._embed_queries(queries)
+        self._maybe_flush()
+        return recall_report(self.embeddings, self.ivf_index, query_matrix, k=k, nprobe_values=nprobe_values)
+
+    def _maybe_flush(self):
+        self.query_cache.maybe_flush()
+
+    def flush(self):
+        # Persist query embeddings added since the last write, if there are any.
+        # The matrix and metadata are untouched.
+        self.query_cache.flush()
+
+    def _path(self, filename):
+        return os.path.join(self.db_path, filename)
+
+    def _store_exists(self):
+        return os.path.exists(self._path(MANIFEST_FILE)) or os.path.exists(self.legacy_db_path)
+
+    def _import_query_cache(self, query_cache):
+        # Move query embeddings from the older single-blob formats into the cache.
+        for query, embedding in query_cache.items():
+            self.query_cache.put(self.embedder.model, query, embedding)
+        self.query_cache.flush()
 
     def save_db(self):
-        data = {
-            "embeddings": self.embeddings,
-            "metadata": self.metadata,
-            "query_cache": json.dumps(self.query_cache),
-        }
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        with open(self.db_path, "wb") as file:
-            pickle.dump(data, file)
+        with self._lock:
+            os.makedirs(self.db_path, exist_ok=True)
+            embeddings = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+            _write_atomic(self._path(EMBEDDINGS_FILE), lambda file: np.save(file, embeddings))
+            _write_json(self._path(METADATA_FILE), self.metadata)
+            _write_json(self._path(CONTENT_HASHES_FILE), self.content_hashes)
+            self.query_cache.flush()
+            if self.ivf_index is not None:
+                _write_atomic(self._path(IVF_INDEX_FILE), self.ivf_index.save)
+            if self.bm25_index is not None:
+                _write_atomic(self._path(BM25_INDEX_FILE), self.bm25_index.save)
+            if self.quantizer is not None:
+                _write_atomic(self._path(QUANTIZER_FILE), lambda file: quantization.save(self.quantizer, file))
+            # The manifest is written last, so a store without one is incomplete.
+            _write_json(
+                self._path(MANIFEST_FILE),
+                {
+                    "format_version": FORMAT_VERSION,
+                    "count": int(embeddings.shape[0]),
+                    "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+                    "dtype": "float32",
+                    "model": self.embedder.model,
+                },
+            )
 
     def load_db(self):
-        if not os.path.exists(self.db_path):
-            raise ValueError("Vector database file not found. Use load_data to create a new database.")
-        with open(self.db_path, "rb") as file:
+        with self._lock:
+            if not os.path.exists(self._path(MANIFEST_FILE)):
+                if os.path.exists(self.legacy_db_path):
+                    self._migrate_legacy_db()
+                    return
+                raise ValueError("Vector database file not found. Use load_data to create a new database.")
+            self._load_store()
+            self._build_metadata_index()
+            self._load_bm25_index()
+            if self.index == "ivf":
+                self._load_ivf_index()
+            if self.storage != "float32":
+                self._load_quantizer()
+            self._start_shards()
+
+    def _load_ivf_index(self):
+        # Reuse the persisted index when it was built over the current matrix,
+        # otherwise rebuild it and store it next to the matrix.
+        if os.path.exists(self._path(IVF_INDEX_FILE)):
+            self.ivf_index = IVFIndex.load(self._path(IVF_INDEX_FILE))
+            if self.ivf_index.count == len(self.embeddings):
+                return
+            print("IVF index does not match the stored embeddings. Rebuilding it.")
+        self.build_ivf_index()
+        _write_atomic(self._path(IVF_INDEX_FILE), self.ivf_index.save)
+
+    def _load_bm25_index(self):
+        if os.path.exists(self._path(BM25_INDEX_FILE)):
+            self.bm25_index = BM25Index.load(self._path(BM25_INDEX_FILE))
+            if self.bm25_index.count == len(self.metadata):
+                return
+            print("BM25 index does not match the stored metadata. Rebuilding it.")
+        self.build_bm25_index()
+        _write_atomic(self._path(BM25_INDEX_FILE), self.bm25_index.save)
+
+    def _load_quantizer(self):
+        # Same policy as the IVF index: reuse matching codes, otherwise re-encode.
+        if os.path.exists(self._path(QUANTIZER_FILE)):
+            self.quantizer = quantization.load(self._path(QUANTIZER_FILE))
+            if self.quantizer.kind == self.storage and len(self.quantizer.codes) == len(self.embeddings):
+                return
+            print("Quantized codes do not match the stored embeddings. Re-encoding them.")
+        self.build_quantizer()
+        _write_atomic(self._path(QUANTIZER_FILE), lambda file: quantization.save(self.quantizer, file))
+
+    def _load_store(self):
+        with open(self._path(MANIFEST_FILE)) as file:
+            manifest = json.load(file)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported vector database format version {manifest.get('format_version')} "
+                f"in {self.db_path}, expected {FORMAT_VERSION}."
+            )
+        if manifest.get("model", DEFAULT_MODEL) != self.embedder.model:
+            raise ValueError(
+                f"{self.db_path} was embedded with {manifest.get('model', DEFAULT_MODEL)}, "
+                f"not {self.embedder.model}."
+            )
+        # Memory-mapped read-only: the rows are paged in on demand and shared through
+        # the page cache by every process that opens the same store.
+        self.embeddings = np.load(self._path(EMBEDDINGS_FILE), mmap_mode="r")
+        with open(self._path(METADATA_FILE)) as file:
+            self.metadata = json.load(file)
+        if os.path.exists(self._path(CONTENT_HASHES_FILE)):
+            with open(self._path(CONTENT_HASHES_FILE)) as file:
+                self.content_hashes = json.load(file)
+        else:
+            self.content_hashes = [_content_hash(self._format_text(item)) for item in self.metadata]
+        if os.path.exists(self._path(LEGACY_QUERY_CACHE_FILE)):
+            with open(self._path(LEGACY_QUERY_CACHE_FILE)) as file:
+                self._import_query_cache(json.load(file))
+            os.remove(self._path(LEGACY_QUERY_CACHE_FILE))
+
+    def _migrate_legacy_db(self):
+        # One-time conversion of a pickled store into the directory layout.
+        print(f"Converting {self.legacy_db_path} to the memory-mapped store format.")
+        with open(self.legacy_db_path, "rb") as file:
             data = pickle.load(file)
-        self.embeddings = data["embeddings"]
+        self.embeddings = _to_matrix(data["embeddings"])
         self.metadata = data["metadata"]
-        self.query_cache = json.loads(data["query_cache"])
\ No newline at end of file
+        self.content_hashes = [_content_hash(self._format_text(item)) for item in self.metadata]
+        self._import_query_cache(json.loads(data["query_cache"]))
+        self._build_indexes()
+        self.save_db()
+        self._start_shards()
+
+
+class SummaryIndexedVectorDB(VectorDB):
+    store_name = "summary_indexed_vector_db"
+    filter_fields = ("chunk_link", "chunk_heading", "summary")
+
+    def _format_text(self, item):
+        # Embed Chunk Heading + Text + Summary Together
+        return f"{item['chunk_heading']}\n\n{item['text']}\n\n{item['summary']}"
+
+    def search(self, query, k=5, similarity_threshold=0.75, where=None):
+        return super().search(query, k=k, similarity_threshold=similarity_threshold, where=where)
+
+    def search_many(self, queries, k=5, similarity_threshold=0.75, where=None):
+        return super().search_many(queries, k=k, similarity_threshold=similarity_threshold, where=where)
+
+    async def asearch(self, query, k=5, similarity_threshold=0.75, where=None):
+        return await super().asearch(query, k=k, similarity_threshold=similarity_threshold, where=where)
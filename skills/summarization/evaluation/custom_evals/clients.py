@@ -0,0 +1,42 @@
+"""Process-wide Anthropic client with a shared keep-alive connection pool.
+
+Creating an `Anthropic` client per call opens a new connection pool, so every
+rerank or grading request pays for a fresh TCP and TLS handshake. `get_client()`
+returns one client per process instead, and requests reuse its idle connections.
+The pool can be sized with environment variables:
+
+    ANTHROPIC_MAX_CONNECTIONS            open connections at once (default 32)
+    ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS  idle connections kept open (default 32)
+    ANTHROPIC_KEEPALIVE_EXPIRY           seconds an idle connection is kept (default 60)
+    ANTHROPIC_MAX_RETRIES                retries on rate limits and overload (default 2)
+"""
+
+import os
+import threading
+
+import httpx
+from anthropic import Anthropic, DefaultHttpxClient
+
+_client = None
+_lock = threading.Lock()
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "32")),
+        max_keepalive_connections=int(os.getenv("ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", "32")),
+        keepalive_expiry=float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY", "60")),
+    )
+
+
+def get_client():
+    """The shared Anthropic client, created on first use. Safe to use from any thread."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = Anthropic(
+                api_key=os.environ.get("ANTHROPIC_API_KEY"),
+                max_retries=int(os.getenv("ANTHROPIC_MAX_RETRIES", "2")),
+                http_client=DefaultHttpxClient(limits=_limits()),
+            )
+        return _client
@@ -1,7 +1,6 @@
-import anthropic
-import os
 import json
 from typing import Dict, TypedDict, Union, Any
+from clients import get_client
 
 def llm_eval(summary, input):
     """
@@ -14,8 +13,6 @@ def llm_eval(summary, input):
     Returns:
     bool: True if the average score is above the threshold, False otherwise.
     """
-    client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-    
     # You could include an example here too and likely improve performance further!
     prompt = f"""Evaluate the following summary based on these criteria:
     1. Conciseness (1-5)
@@ -52,7 +49,7 @@ def llm_eval(summary, input):
     
     Evaluation (JSON format):"""
     
-    response = client.messages.create(
+    response = get_client().messages.create(
         model="claude-3-5-sonnet-20241022",
         max_tokens=1000,
         temperature=0,
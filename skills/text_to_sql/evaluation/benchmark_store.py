@@ -0,0 +1,33 @@
+"""How ../../vectordb_benchmark.py opens, fills, reloads and searches this skill's VectorDB."""
+
+import os
+
+from vectordb import VectorDB
+
+NAME = "text_to_sql"
+
+
+# The store takes its path in the constructor, which also loads it.
+def open_store(root, embedder):
+    return VectorDB(
+        db_path=os.path.join(root, "vector_db"),
+        embedder=embedder,
+        query_cache_path=os.path.join(root, "query_cache.sqlite"),
+    )
+
+
+def build_store(db, embeddings, metadata):
+    db.embeddings, db.metadata = embeddings, metadata
+
+
+def load_store(root, embedder):
+    return open_store(root, embedder)
+
+
+def search(db, query, k):
+    return db.search(query, k=k, similarity_threshold=-1.0)
+
+
+def search_many(db, queries, k):
+    # This VectorDB has no batched search, so a batch is searched one query at a time.
+    return [db.search(query, k=k, similarity_threshold=-1.0) for query in queries]
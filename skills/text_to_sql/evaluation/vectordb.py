@@ -1,43 +1,100 @@
 import os
 import numpy as np
-import voyageai
 import pickle
 import json
+import threading
+from embeddings import DEFAULT_MODEL, get_embedder
+from ingest import embed_batches
+from query_cache import open_query_cache
+
+# On-disk layout of the store directory. Bump when the layout changes.
+FORMAT_VERSION = 1
+
+def _write_atomic(path, write):
+    # Write to a temp file and rename it over the target so a reader never sees a partial file.
+    # The temp name is unique per process and thread, so concurrent writers never share one.
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as file:
+        write(file)
+    os.replace(tmp_path, path)
+
+def _write_json(path, obj):
+    _write_atomic(path, lambda file: file.write(json.dumps(obj, separators=(",", ":")).encode("utf-8")))
 
 class VectorDB:
-    def __init__(self, db_path='../data/vector_db.pkl'):
-        self.client = voyageai.Client(api_key=os.getenv("VOYAGE_API_KEY"))
-        self.db_path = db_path
+    def __init__(self, db_path='../data/vector_db', embedder=None, query_cache_path=None):
+        # Voyage by default, or the provider named by EMBEDDING_PROVIDER (see embeddings.py)
+        self.embedder = embedder if embedder is not None else get_embedder()
+        # Accept the old pickle path too; the store directory sits next to it
+        self.db_path = db_path[:-len('.pkl')] if db_path.endswith('.pkl') else db_path
+        # Stores embedded with a non-default model live next to the default one
+        if self.embedder.model != DEFAULT_MODEL:
+            self.db_path = f"{self.db_path}-{self.embedder.model}"
+        self.legacy_db_path = f"{self.db_path}.pkl"
+        # Bounded LRU of query embeddings in SQLite, shareable with the other skills via QUERY_CACHE_PATH
+        self.query_cache = open_query_cache(query_cache_path, default_path=os.path.join(self.db_path, 'query_cache.sqlite'))
         self.load_db()
 
     def load_db(self):
-        if os.path.exists(self.db_path):
-            with open(self.db_path, "rb") as file:
+        manifest_path = os.path.join(self.db_path, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            if manifest.get('format_version') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported vector database format version {manifest.get('format_version')}, expected {FORMAT_VERSION}.")
+            if manifest.get('model', DEFAULT_MODEL) != self.embedder.model:
+                raise ValueError(f"{self.db_path} was embedded with {manifest.get('model', DEFAULT_MODEL)}, not {self.embedder.model}.")
+            # Memory-map the matrix read-only so it is shared through the page cache
+            self.embeddings = np.load(os.path.join(self.db_path, 'embeddings.npy'), mmap_mode='r')
+            with open(os.path.join(self.db_path, 'metadata.json')) as file:
+                self.metadata = json.load(file)
+            # Move query embeddings from the older single-file cache into the SQLite cache
+            legacy_query_cache_path = os.path.join(self.db_path, 'query_cache.json')
+            if os.path.exists(legacy_query_cache_path):
+                with open(legacy_query_cache_path) as file:
+                    self.import_query_cache(json.load(file))
+                os.remove(legacy_query_cache_path)
+        elif os.path.exists(self.legacy_db_path):
+            # One-time conversion of the pickled store into the directory layout
+            with open(self.legacy_db_path, "rb") as file:
                 data = pickle.load(file)
-            self.embeddings, self.metadata, self.query_cache = data['embeddings'], data['metadata'], json.loads(data['query_cache'])
+            self.embeddings, self.metadata = np.array(data['embeddings'], dtype=np.float32), data['metadata']
+            self.import_query_cache(json.loads(data['query_cache']))
+            self.save_db()
         else:
-            self.embeddings, self.metadata, self.query_cache = [], [], {}
+            self.embeddings, self.metadata = np.empty((0, 0), dtype=np.float32), []
+
+    def import_query_cache(self, query_cache):
+        for query, embedding in query_cache.items():
+            self.query_cache.put(self.embedder.model, query, embedding)
+        self.query_cache.flush()
 
     def load_data(self, data):
-        if not self.embeddings:
+        if not len(self.embeddings):
                 texts = [item["text"] for item in data]
-                self.embeddings = [emb for batch in range(0, len(texts), 128) 
-                                    for emb in self.client.embed(texts[batch:batch+128], model="voyage-2").embeddings]
+                self.embeddings = embed_batches(self.embedder.embed, texts, checkpoint_dir=f"{self.db_path}.ingest")
                 self.metadata = [item["metadata"] for item in data]  # Store only the inner metadata
                 self.save_db()
 
     def search(self, query, k=5, similarity_threshold=0.3):
-        if query not in self.query_cache:
-            self.query_cache[query] = self.client.embed([query], model="voyage-2").embeddings[0]
-            self.save_db()
-        
-        similarities = np.dot(self.embeddings, self.query_cache[query])
+        # Thresholds are on the voyage-2 scale (see embeddings.py)
+        similarity_threshold *= getattr(self.embedder, "similarity_scale", 1.0)
+        # Concurrent searches for the same uncached query share one embed request
+        query_embedding = self.query_cache.get_many(self.embedder.model, [query], self.embedder.embed)[query]
+        self.query_cache.maybe_flush()
+
+        similarities = np.dot(self.embeddings, query_embedding)
         top_indices = np.argsort(similarities)[::-1]
-        
-        return [{"metadata": self.metadata[i], "similarity": similarities[i]} 
+
+        return [{"metadata": self.metadata[i], "similarity": similarities[i]}
                 for i in top_indices if similarities[i] >= similarity_threshold][:k]
 
     def save_db(self):
-        with open(self.db_path, "wb") as file:
-            pickle.dump({"embeddings": self.embeddings, "metadata": self.metadata, 
-                         "query_cache": json.dumps(self.query_cache)}, file)
\ No newline at end of file
+        os.makedirs(self.db_path, exist_ok=True)
+        embeddings = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+        _write_atomic(os.path.join(self.db_path, 'embeddings.npy'), lambda file: np.save(file, embeddings))
+        _write_json(os.path.join(self.db_path, 'metadata.json'), self.metadata)
+        self.query_cache.flush()
+        # The manifest is written last, so a store without one is incomplete
+        _write_json(os.path.join(self.db_path, 'manifest.json'),
+                    {'format_version': FORMAT_VERSION, 'count': len(embeddings), 'dtype': 'float32', 'model': self.embedder.model})
@@ -0,0 +1,214 @@
+"""Offline latency, throughput and persistence benchmark for the skills' VectorDBs.
+
+The corpus is a synthetic matrix of random unit vectors written straight into the
+store, and queries are embedded by a deterministic synthetic embedder, so nothing
+touches the network. Every corpus size is saved, reloaded from disk and searched,
+and the measurements are printed (or written) as JSON so runs before and after a
+change can be compared:
+
+    python skills/vectordb_benchmark.py skills/classification/evaluation \
+        --sizes 1000,100000,1000000 --dim 1024 --output before.json
+
+The first argument is a skill's evaluation directory. Its benchmark_store.py module
+tells the harness how that skill's VectorDB is opened, filled, reloaded and searched.
+Derived indexes are built before the store is saved, as load_data does, so
+load_db_s measures a load and not a rebuild. The similarity threshold is disabled,
+so every query returns k results.
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+class SyntheticEmbeddings:
+    """Deterministic random unit vectors seeded by each text."""
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.model = f"synthetic-{dim}"
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(
+                hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little"
+            )
+            vector = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+            vectors.append(vector / np.linalg.norm(vector))
+        return vectors
+
+
+def synthetic_corpus(size, dim, seed=0, block_size=65536):
+    rng = np.random.default_rng(seed)
+    embeddings = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, block_size):
+        block = rng.standard_normal((min(block_size, size - start), dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        embeddings[start : start + len(block)] = block
+    metadata = [
+        {
+            "chunk_link": f"https://example.com/doc-{i}",
+            "chunk_heading": f"Section {i % 1000}",
+            "text": f"Synthetic chunk {i}",
+            "label": f"label-{i % 10}",
+        }
+        for i in range(size)
+    ]
+    return embeddings, metadata
+
+
+def _rss_bytes():
+    # Current resident set size, including the pages of memory-mapped stores that were touched.
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+def _directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _percentiles(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "p50": float(np.percentile(milliseconds, 50)),
+        "p95": float(np.percentile(milliseconds, 95)),
+        "p99": float(np.percentile(milliseconds, 99)),
+        "mean": float(milliseconds.mean()),
+    }
+
+
+def benchmark_size(store, root, size, dim, n_queries, k, batch_size, seed):
+    # `store` is the skill's benchmark_store module.
+    embedder = SyntheticEmbeddings(dim)
+    embeddings, metadata = synthetic_corpus(size, dim, seed=seed)
+
+    writer = store.open_store(root, embedder)
+    start = time.perf_counter()
+    store.build_store(writer, embeddings, metadata)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    writer.save_db()
+    save_seconds = time.perf_counter() - start
+    del writer, embeddings, metadata
+
+    rss_before_load = _rss_bytes()
+    start = time.perf_counter()
+    db = store.load_store(root, embedder)
+    load_seconds = time.perf_counter() - start
+    rss_after_load = _rss_bytes()
+
+    # The first pass embeds every query and adds it to the query cache; the timed
+    # passes below measure search against cached query embeddings.
+    queries = [f"benchmark query {i}" for i in range(n_queries)]
+    start = time.perf_counter()
+    for query in queries:
+        store.search(db, query, k)
+    cold_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    db.query_cache.flush()
+    flush_seconds = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.search(db, query, k)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, n_queries, batch_size):
+        store.search_many(db, queries[i : i + batch_size], k)
+    batched_seconds = time.perf_counter() - start
+
+    return {
+        "size": size,
+        "matrix_bytes": size * dim * 4,
+        "store_bytes": _directory_bytes(db.db_path),
+        "build_indexes_s": build_seconds,
+        "save_db_s": save_seconds,
+        "load_db_s": load_seconds,
+        "rss_load_delta_bytes": None
+        if rss_before_load is None
+        else rss_after_load - rss_before_load,
+        "rss_after_search_bytes": _rss_bytes(),
+        "cold_search_mean_ms": cold_seconds / n_queries * 1000,
+        "query_cache_flush_ms": flush_seconds * 1000,
+        "search_latency_ms": _percentiles(latencies),
+        "batched_qps": n_queries / batched_seconds,
+        "batch_size": batch_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "evaluation_dir", help="a skill's evaluation directory, with benchmark_store.py"
+    )
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated corpus sizes")
+    parser.add_argument(
+        "--dim", type=int, default=1024, help="embedding dimension (voyage-2 uses 1024)"
+    )
+    parser.add_argument("--queries", type=int, default=200, help="queries per corpus size")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64, help="queries per search_many call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", metavar="PATH", help="write the JSON report here instead of stdout"
+    )
+    args = parser.parse_args()
+
+    # The skill's modules import each other by bare name, as they do under promptfoo.
+    sys.path.insert(0, os.path.abspath(args.evaluation_dir))
+    store = importlib.import_module("benchmark_store")
+
+    report = {
+        "vectordb": store.NAME,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "dim": args.dim,
+        "k": args.k,
+        "queries": args.queries,
+        "results": [],
+    }
+    cwd = os.getcwd()
+    for size in (int(size) for size in args.sizes.split(",")):
+        # Every store writes below a throwaway directory, including stores that
+        # resolve their path relative to the working directory.
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "work"))
+            os.chdir(os.path.join(root, "work"))
+            try:
+                result = benchmark_size(
+                    store, root, size, args.dim, args.queries, args.k, args.batch_size, args.seed
+                )
+            finally:
+                os.chdir(cwd)
+        print(f"{size} rows: p50 {result['search_latency_ms']['p50']:.2f} ms", file=sys.stderr)
+        report["results"].append(result)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()